@@ -0,0 +1,201 @@
+
+import argparse
+import contextlib
+import functools
+import glob
+import importlib
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+from scipy import stats
+
+import simulate_model
+import simulate_Jordan_model
+from models import pragmatic_punisher_models
+from utils import joint_density
+from utils import instrumentation
+from utils import quadrature
+
+# the configs that are benchmarked, by the folders they are in
+CONFIG_FOLDERS = ['paper', 'conceptual']
+
+# the Jordan & Rand (2020) configs are simulated together by simulate_Jordan_model; the "both" config needs the
+# posteriors of the "only" condition and cannot be simulated on its own
+JORDAN_CONFIGS = {'paper.Jordan_Rand_2020.only_condition_audience1': 'paper.Jordan_Rand_2020.both_condition_audience1'}
+SKIPPED_CONFIGS = ['paper.Jordan_Rand_2020.both_condition_audience1']
+
+# the arguments of get_config for the configs that need them
+CONFIG_ARGS = {'conceptual.cost_benefit_all_audience1': [250]}
+
+# the step sizes of the alpha_selfish and alpha_social grids
+DEFAULT_RESOLUTIONS = [0.5, 0.2, 0.1]
+# the numbers of Gaussian quadrature nodes in each dimension (none by default)
+DEFAULT_NODES = []
+
+def find_configs(config_folders=CONFIG_FOLDERS):
+    # the names of all the config modules in the config folders, e.g. 'paper.Rai_2021.exp1_audience1'
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configs')
+    config_names = []
+    for folder in config_folders:
+        for path in sorted(glob.glob(os.path.join(config_dir, folder, '**', '*.py'), recursive=True)):
+            name = os.path.relpath(path, config_dir)[:-len('.py')].replace(os.sep, '.')
+            if not name.endswith('__init__') and name not in SKIPPED_CONFIGS:
+                config_names.append(name)
+    return config_names
+
+def get_integrations(resolutions=DEFAULT_RESOLUTIONS, nodes=DEFAULT_NODES):
+    # the integration backends that are benchmarked, as (name, resolution, backend)
+    integrations = [('grid', resolution, quadrature.GridIntegration(np.arange(0, 10, resolution))) for resolution in resolutions]
+    integrations += [('gauss', n_nodes, quadrature.GaussIntegration(n_nodes)) for n_nodes in nodes]
+    return integrations
+
+def get_alpha_prior():
+    # the population prior of the simulations, as in model_simulation_plots.ipynb
+    return joint_density.JointIndependent([stats.expon(scale=1/(1/3)),   # prior over alpha_selfish
+                                           stats.uniform(0, 10)])  # prior over alpha_social
+
+def get_params(config_module, config, integration):
+    # the simulation parameters of a config, as in model_simulation_plots.ipynb, with the nodes and weights of
+    # the integration backend
+    available_actions = {key: config[key]['available_actions'] for key in config.keys()}
+    (alpha_selfish_range, alpha_social_range), alpha_prior_weights = integration.nodes(get_alpha_prior())
+    params = {'available_actions': available_actions,
+              'alpha_selfish_set': {key: alpha_selfish_range for key in config.keys()},
+              'alpha_social_set': {key: alpha_social_range for key in config.keys()},
+              'alpha_target': {key: config[key]['alpha_target'] for key in config.keys()},
+              'selfish_utilities': {key: config_module.get_selfish_utilities(key, available_actions[key]) for key in config.keys()},
+              'social_utilities': {key: config_module.get_social_utilities(key, available_actions[key]) for key in config.keys()},
+              'target_utilities': {key: config_module.get_target_utilities(key, available_actions[key]) for key in config.keys()},
+              'alpha_prior': alpha_prior_weights}
+    return params
+
+def get_simulation(config_name, integration):
+    # a function without arguments that runs the simulation of the config
+    if config_name in JORDAN_CONFIGS:
+        return functools.partial(simulate_Jordan_model.simulate, config_name, JORDAN_CONFIGS[config_name],
+                                 save=False, integration=integration)
+    config_module = importlib.import_module(f"configs.{config_name}")
+    config = config_module.get_config(*CONFIG_ARGS.get(config_name, []))
+    params = get_params(config_module, config, integration)
+    return functools.partial(simulate_model.simulate, config_name, config, params, save=False)
+
+def run_simulation(simulation, verbose=False):
+    # the simulations print the utilities and parameters of every config key, which are hidden unless verbose
+    # the audience judgements are shared between runs, so they are cleared to time every run from scratch
+    pragmatic_punisher_models.PragmaticPunisher.judgement_cache.cache_clear()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        simulation()
+
+def benchmark(config_name, integration=('grid', 0.1, quadrature.GridIntegration()), repeat=3, verbose=False):
+    # the wall time is the minimum over the repeats; the peak memory and the instrumentation report (calls and time
+    # of the hot paths and the stages of the simulation) are measured in a separate run, since tracing the memory
+    # allocations slows down the simulation
+    integration_name, resolution, backend = integration
+    simulation = get_simulation(config_name, backend)
+
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_simulation(simulation, verbose)
+        wall_times.append(time.perf_counter() - start)
+
+    with instrumentation.record() as recorder:
+        tracemalloc.start()
+        run_simulation(simulation, verbose)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    report = recorder.report()
+
+    return {'config': config_name,
+            'integration': integration_name,
+            'resolution': resolution,
+            'grid_size': int(np.size(backend.nodes(get_alpha_prior())[1])),
+            'wall_time': min(wall_times),
+            'wall_times': wall_times,
+            'peak_memory': peak_memory,
+            'calls': {name: stage['calls'] for name, stage in report['stages'].items()},
+            'counters': report['counters'],
+            'stages': report['stages']}
+
+def run_benchmarks(config_names=None, integrations=None, repeat=3, verbose=False):
+    if config_names is None:
+        config_names = find_configs()
+    if integrations is None:
+        integrations = get_integrations()
+    results = []
+    for config_name in config_names:
+        for integration in integrations:
+            result = benchmark(config_name, integration, repeat, verbose)
+            print(f"{config_name} ({result['integration']} {result['resolution']}): {result['wall_time']:.3f} s, "
+                  f"{result['peak_memory'] / 2**20:.1f} MiB")
+            results.append(result)
+    return {'machine': {'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'platform': platform.platform(),
+                        'processor': platform.processor()},
+            'results': results}
+
+def compare(results, baseline, time_tolerance=0.2, memory_tolerance=0.2):
+    # compares the results with a baseline of the same configs and integrations; a benchmark is a regression if its
+    # wall time or peak memory is larger than the baseline by more than the relative tolerance. Changes in the call
+    # counts are reported, but they are not regressions by themselves
+    baseline_results = {(result['config'], result.get('integration', 'grid'), result['resolution']): result
+                        for result in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        base = baseline_results.get((result['config'], result['integration'], result['resolution']))
+        if base is None:
+            continue
+        time_ratio = result['wall_time'] / base['wall_time']
+        memory_ratio = result['peak_memory'] / base['peak_memory'] if base['peak_memory'] else 1
+        comparison.append({'config': result['config'],
+                           'integration': result['integration'],
+                           'resolution': result['resolution'],
+                           'time_ratio': time_ratio,
+                           'memory_ratio': memory_ratio,
+                           'changed_calls': {name: [base['calls'].get(name), count]
+                                             for name, count in result['calls'].items()
+                                             if base['calls'].get(name) != count},
+                           'regression': time_ratio > 1 + time_tolerance or memory_ratio > 1 + memory_tolerance})
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation of the paper and conceptual configs")
+    parser.add_argument('--configs', nargs='+', default=None,
+                        help="config names, e.g. paper.Rai_2021.exp1_audience1 (default: all the paper and conceptual configs)")
+    parser.add_argument('--resolutions', nargs='+', type=float, default=DEFAULT_RESOLUTIONS,
+                        help="step sizes of the alpha_selfish and alpha_social grids")
+    parser.add_argument('--nodes', nargs='+', type=int, default=DEFAULT_NODES,
+                        help="numbers of Gaussian quadrature nodes in each dimension, benchmarked besides the grids")
+    parser.add_argument('--repeat', type=int, default=3, help="number of timed runs of every benchmark")
+    parser.add_argument('--output', default='benchmark_results.json', help="file to write the results to")
+    parser.add_argument('--baseline', default=None, help="results file of a previous run to compare with")
+    parser.add_argument('--time-tolerance', type=float, default=0.2,
+                        help="allowed relative increase of the wall time over the baseline")
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help="allowed relative increase of the peak memory over the baseline")
+    parser.add_argument('--verbose', action='store_true', help="show the output of the simulations")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.configs, get_integrations(args.resolutions, args.nodes), args.repeat, args.verbose)
+    if args.baseline is not None:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        results['comparison'] = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        for item in results['comparison']:
+            status = "REGRESSION" if item['regression'] else "ok"
+            print(f"{status}: {item['config']} ({item['integration']} {item['resolution']}): "
+                  f"time x{item['time_ratio']:.2f}, memory x{item['memory_ratio']:.2f}")
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=1)
+
+    if any(item['regression'] for item in results.get('comparison', [])):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
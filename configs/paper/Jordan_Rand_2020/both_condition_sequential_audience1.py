@@ -0,0 +1,138 @@
+import itertools
+
+from models import base_punisher_models
+from models import typed_audience_models as audience_models
+from models import pragmatic_punisher_models
+from utils import joint_density
+from configs.paper.Jordan_Rand_2020 import only_condition_audience1
+from configs.paper.Jordan_Rand_2020 import both_condition_audience1
+
+# The "both" condition of J. J. Jordan and Rand (2020) with a sequential audience: instead of using the posteriors
+# of a previously simulated "only" condition as the priors of the audience, the audience observes the history of
+# actions of the agent in the "only" contexts and updates its posterior over agent types itself. Each sequence is
+# the decision context of the agent and the history of (context, action) pairs observed by the audience, and can
+# be of any length.
+DEFAULT_SEQUENCES = {'Both - H': ('Both-punishment', [('Help-only', 'Help')]),
+                     'Both - NH': ('Both-punishment', [('Help-only', 'Not-help')]),
+                     'Both - P': ('Both-helping', [('Punishment-only', 'Punish')]),
+                     'Both - NP': ('Both-helping', [('Punishment-only', 'Not-punish')])}
+
+def get_available_actions(key):
+    return both_condition_audience1.get_available_actions(get_decision_context(key))
+
+def get_selfish_utilities(key, available_actions):
+    return both_condition_audience1.get_selfish_utilities(get_decision_context(key), available_actions)
+
+def get_social_utilities(key, available_actions):
+    return both_condition_audience1.get_social_utilities(get_decision_context(key), available_actions)
+
+def get_target_utilities(key, available_actions):
+    return both_condition_audience1.get_target_utilities(get_decision_context(key), available_actions)
+
+def get_decision_context(key, sequences=None):
+    # the context of the decision of the agent of the key, e.g. 'Both-punishment'
+    if sequences is None:
+        sequences = DEFAULT_SEQUENCES
+    return sequences[key][0] if key in sequences else key
+
+def get_alpha_set():
+    return both_condition_audience1.get_alpha_set()
+
+def get_history(observed_actions):
+    # the history observed by the audience, where the punisher model of each observation is the base punisher
+    # of the "only" condition of its context
+    only_config = only_condition_audience1.get_config()
+    history = []
+    for context, action in observed_actions:
+        audience_kwargs = only_config[context]['base_audience']['kwargs']
+        history.append({'available_actions': only_config[context]['available_actions'],
+                        'action': action,
+                        'punisher_model': audience_kwargs['punisher_model'],
+                        'punisher_model_kwargs': audience_kwargs['punisher_model_kwargs'],
+                        'alpha_target': audience_kwargs['alpha_target']})
+    return history
+
+def get_config(sequences=None):
+    if sequences is None:
+        sequences = DEFAULT_SEQUENCES
+    alpha_selfish_set, alpha_social_set, alpha_target = get_alpha_set()
+    permut = itertools.permutations(list(alpha_selfish_set.keys()), len(alpha_social_set))
+    all_types_combinations = []
+    # zip() is called to pair each permutation
+    # and shorter list element into combination
+    for comb in permut:
+        zipped = zip(comb, (alpha_social_set.keys()))
+        all_types_combinations.append(list(zipped))
+    all_types_combinations = list(itertools.chain.from_iterable(all_types_combinations))
+
+    config = {}
+    for key, (context, observed_actions) in sequences.items():
+        available_actions = get_available_actions(context)
+        base_punisher_config = {
+            'constructor': base_punisher_models.BasePunisher,
+            'kwargs':{
+                'alpha_selfish': 5.0,
+                'alpha_social': 5.0,
+                'alpha_target': alpha_target,
+                'softmax_beta': 0.02,
+                'selfish_utilities': both_condition_audience1.get_selfish_utilities(context, available_actions),
+                'social_utilities': both_condition_audience1.get_social_utilities(context, available_actions),
+                'target_utilities': both_condition_audience1.get_target_utilities(context, available_actions)
+            }
+        }
+
+        # the prior of the audience before observing the history
+        audience_alpha_prior = joint_density.JointDiscrete(pmf_values= {type: 1/(len(alpha_selfish_set) * len(alpha_social_set))    # uniform prior
+                                                                        for type in all_types_combinations},
+                                                           domain=[list(alpha_selfish_set.keys()), list(alpha_social_set.keys())])
+        history = get_history(observed_actions)
+
+        base_audience_config = {
+            'constructor': audience_models.SequentialAudience1,
+            'kwargs':{
+                'alpha_prior': audience_alpha_prior,
+                'alpha_selfish_set': alpha_selfish_set,
+                'alpha_social_set': alpha_social_set,
+                'alpha_target': alpha_target,
+                'punisher_model': base_punisher_config['constructor'],
+                'punisher_model_kwargs': base_punisher_config['kwargs'],
+                'history': history
+            }
+        }
+
+        pragmatic_punisher_config = {
+            'constructor': pragmatic_punisher_models.PragmaticPunisher,
+            'kwargs':{
+                'alpha_reputation': 350,
+                'base_punisher': base_punisher_config['constructor'],
+                'base_punisher_kwargs': base_punisher_config['kwargs'],
+                'audience': base_audience_config['constructor'],
+                'audience_kwargs': base_audience_config['kwargs']
+            }
+        }
+
+        pragmatic_audience_config = {
+            'constructor': audience_models.SequentialAudience1,
+            'kwargs':{
+                'alpha_prior': audience_alpha_prior,
+                'alpha_selfish_set': alpha_selfish_set,
+                'alpha_social_set': alpha_social_set,
+                'alpha_target': alpha_target,
+                'punisher_model': pragmatic_punisher_config['constructor'],
+                'punisher_model_kwargs': pragmatic_punisher_config['kwargs'],
+                'history': history
+            }
+        }
+
+        config[key] = {
+            'available_actions': available_actions,
+            'alpha_selfish_set': alpha_selfish_set,
+            'alpha_social_set': alpha_social_set,
+            'alpha_target': alpha_target,
+            'base_punisher': base_punisher_config,
+            'base_audience': base_audience_config,
+            'pragmatic_punisher': pragmatic_punisher_config,
+            'pragmatic_audience': pragmatic_audience_config,
+        }
+
+    return config
@@ -0,0 +1,92 @@
+
+import numpy as np
+import pandas as pd
+
+from simulate_population import JORDAN_DESIGN, JORDAN_REPUTATION_LEVELS, JORDAN_ACTION_VALUES, get_key_policy
+
+# Likelihood of the choices of every participant in all_data.csv under the per-type policies of the model, instead of
+# the four punishment rates of preprocess.py. A participant is an agent of one type drawn from the prior, who makes
+# the decisions of their condition in order (as in simulate_population.JORDAN_DESIGN), so the probability of their
+# choices is the prior-weighted sum over the types of the product of the policies of the decisions. Participants
+# with the same condition, TG and choices have the same probability, so the rows are first grouped into cells with
+# their counts, and the likelihood is computed once per cell.
+
+def get_design_conditions(all_data, studies=(9, 10), design=JORDAN_DESIGN):
+    # the participants of the studies with the condition of the design they are in, in the column 'design_condition'
+    data = all_data[all_data['study'].isin(studies)].copy()
+    data['design_condition'] = None
+    for condition, spec in design.items():
+        indices = np.ones(len(data), dtype=bool)
+        for column, value in spec['columns'].items():
+            indices &= (data[column] == value).to_numpy()
+        data.loc[indices, 'design_condition'] = condition
+    return data[data['design_condition'].notna()]
+
+def get_cell_columns(design=JORDAN_DESIGN):
+    # the columns that identify a cell: the condition, TG and the choices of all the decisions
+    return ['design_condition', 'TG'] + list(dict.fromkeys(column for spec in design.values()
+                                                           for column, _ in spec['decisions']))
+
+def get_cells(all_data, studies=(9, 10), design=JORDAN_DESIGN):
+    # the distinct (condition, TG, choices) cells of the participants of the studies, with the number of participants
+    # n of each cell; a choice is nan if the participant did not make (or did not report) the decision
+    data = get_design_conditions(all_data, studies, design)
+    return data.groupby(get_cell_columns(design), dropna=False).size().rename('n').reset_index()
+
+def get_row_cells(all_data, cells, studies=(9, 10), design=JORDAN_DESIGN):
+    # the index of the cell of every participant of the studies in cells, as a series indexed like all_data
+    data = get_design_conditions(all_data, studies, design)
+    on = get_cell_columns(design)
+    keys = cells[on].reset_index().rename(columns={'index': 'cell'})
+    # pandas merges nan with nan, so the participants with missing choices are matched to their cell
+    data = data[on].reset_index().merge(keys, on=on, how='left')
+    return pd.Series(data['cell'].to_numpy(), index=data['index'].to_numpy())
+
+def cell_probability(policies, alpha_prior, decisions, choices):
+    # probability of the choices of one cell: the sum over the types of the prior times the probability of the
+    # sequence of decisions. The probability is propagated over the decisions separately for each action of the
+    # previous decision, since the key of a decision can depend on it; missing choices are summed over
+    paths = {None: np.asarray(alpha_prior, dtype=float)}
+    for column, key in decisions:
+        choice = choices[column]
+        new_paths = {}
+        for previous_action, path in paths.items():
+            policy, actions = policies[key[previous_action] if isinstance(key, dict) else key]
+            for a, action in enumerate(actions):
+                if pd.isna(choice) or JORDAN_ACTION_VALUES[action] == choice:
+                    new_paths[action] = new_paths.get(action, 0) + path * policy[..., a]
+        paths = new_paths
+    return sum(np.sum(path) for path in paths.values())
+
+def cell_log_likelihood(cells, policy_store, alpha_prior, design=JORDAN_DESIGN,
+                        reputation_levels=JORDAN_REPUTATION_LEVELS):
+    # log probability of the choices of a participant of each cell, under the policies of the policy store of
+    # simulate_Jordan_model.simulate and the discretized prior alpha_prior of shape (n_selfish, n_social). The
+    # pragmatic punishers with low and high audience value model the TG = 0 and TG = 1 participants
+    policies = {}
+    log_p = np.zeros(len(cells))
+    for c, cell in enumerate(cells.itertuples(index=False)):
+        cell = cell._asdict()
+        level = reputation_levels[cell['TG']]
+        decisions = design[cell['design_condition']]['decisions']
+        for _, key in decisions:
+            for k in (key.values() if isinstance(key, dict) else [key]):
+                if (k, level) not in policies:
+                    policies[(k, level)] = get_key_policy(policy_store, k, level)
+        level_policies = {k: policies[(k, l)] for k, l in policies if l == level}
+        log_p[c] = np.log(cell_probability(level_policies, alpha_prior, decisions, cell))
+    return log_p
+
+def log_likelihood(all_data, model_data, alpha_prior, studies=(9, 10), design=JORDAN_DESIGN,
+                   reputation_levels=JORDAN_REPUTATION_LEVELS):
+    # log likelihood of the choices of all the participants of the studies, and the cells with the log probability
+    # of a participant ('log_p') and the log likelihood of all its participants ('log_likelihood')
+    cells = get_cells(all_data, studies, design)
+    cells['log_p'] = cell_log_likelihood(cells, model_data['policy_store'], alpha_prior, design, reputation_levels)
+    cells['log_likelihood'] = cells['n'] * cells['log_p']
+    return cells['log_likelihood'].sum(), cells
+
+def participant_log_likelihood(all_data, cells, studies=(9, 10), design=JORDAN_DESIGN):
+    # log probability of the choices of every participant of the studies, from the cells of log_likelihood
+    row_cells = get_row_cells(all_data, cells, studies, design)
+    return pd.Series(cells['log_p'].to_numpy()[row_cells.to_numpy()], index=row_cells.index)
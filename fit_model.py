@@ -0,0 +1,308 @@
+import argparse
+import importlib
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy import optimize
+from tabulate import tabulate
+
+import simulate_model
+import simulate_Jordan_model
+from utils import softmax
+
+# Maximum-likelihood fitting of the parameters of the model to the experimental data. Every dataset is a list of
+# cells, each with the number of participants n and the number k of them who chose one action; the model
+# probability of the action in a cell is the population average of the policy of one key (or a mixture of keys) at
+# one reputation level ('base', 'low' or 'high'). The utilities of the base punishers on the (alpha_selfish,
+# alpha_social) grid are computed once per dataset, so an evaluation of the likelihood and of its analytic gradient
+# only takes a softmax and a prior-weighted sum over the grid for each key and level, instead of a call of simulate.
+# The softmax_beta of the config is also the softmax_beta of the punisher model that the audience reasons about, so
+# the audience judgements are simulated again for each fitted softmax_beta, as when it is edited in the configs; they
+# only take the policies of the few agent types of the audience. Their derivative with respect to softmax_beta is a
+# central difference in log softmax_beta.
+
+# the parameters that can be fitted: the softmax_beta of the punishers, the alpha_reputation of the pragmatic
+# punishers with high audience value, the ratio of the alpha_reputation with low and high audience value, and the
+# scale of the exponential prior over alpha_selfish. They are all positive and are fitted on the log scale
+FIT_PARAMETERS = ['softmax_beta', 'alpha_reputation', 'low_reputation_ratio', 'alpha_selfish_scale']
+
+# the prior over alpha_social is fixed to the uniform prior on [0, 10) of the simulations
+ALPHA_SOCIAL_PRIOR = stats.uniform(0, 10)
+
+# the step in log softmax_beta of the central differences of the audience judgements
+LOG_BETA_STEP = 1e-4
+
+def get_configs(dataset, softmax_beta=None):
+    # the configs of the keys of a dataset. If softmax_beta is given, it is set in the kwargs of the base punishers,
+    # which are also the kwargs of the punisher models of the audiences, as when it is edited in the config files
+    def load(config_name, *args):
+        config = importlib.import_module(f'configs.paper.{config_name}').get_config(*args)
+        if softmax_beta is not None:
+            for key in config.keys():
+                config[key]['base_punisher']['kwargs']['softmax_beta'] = softmax_beta
+        return config
+    if dataset == 'Jordan_Rand_2020':
+        # the priors of the audiences of the "both" config are the posteriors of the audiences of the "only" config
+        config = load('Jordan_Rand_2020.only_condition_audience1')
+        available_actions = {key: config[key]['available_actions'] for key in config.keys()}
+        alpha_posterior = simulate_Jordan_model.get_alpha_posterior(config, available_actions)
+        config_both = load('Jordan_Rand_2020.both_condition_audience1',
+                           simulate_Jordan_model.get_both_condition_priors(alpha_posterior, available_actions))
+        return [config, config_both]
+    elif dataset == 'Batistoni_2021':
+        return [load('Batistoni_2021.exp1_stage1_audience1')]
+    elif dataset == 'Rai_2021_exp1':
+        return [load('Rai_2021.exp1_audience1')]
+    else:
+        raise ValueError(f"unknown dataset {dataset}")
+
+def get_audience_judgements(dataset, softmax_beta=None):
+    # the audience judgement of every key of a dataset, as an array over the available actions, with softmax_beta
+    # set in the configs (or the softmax_beta of the configs if it is None)
+    judgements = {}
+    for config in get_configs(dataset, softmax_beta):
+        for key in config.keys():
+            pragmatic_punisher = config[key]['pragmatic_punisher']['constructor'](**config[key]['pragmatic_punisher']['kwargs'])
+            P_legitimate = pragmatic_punisher.simulate_audience_judgement(config[key]['available_actions'])
+            judgements[key] = np.array([P_legitimate[a] for a in config[key]['available_actions']], dtype=float)
+    return judgements
+
+def get_model_terms(config, alpha_selfish_range, alpha_social_range):
+    # the parts of the policies of the keys of a config that do not depend on the fitted parameters: the utilities
+    # of the base punishers on the grid, with shape (n_selfish, n_social, n_actions)
+    terms = {}
+    for key in config.keys():
+        pragmatic_punisher = config[key]['pragmatic_punisher']['constructor'](**config[key]['pragmatic_punisher']['kwargs'])
+        available_actions = config[key]['available_actions']
+        terms[key] = {'available_actions': available_actions,
+                      'U_base': pragmatic_punisher.base_punisher.batch_utility(available_actions, alpha_selfish_range,
+                                                                               alpha_social_range),
+                      'softmax_beta': pragmatic_punisher.get_softmax_beta(),
+                      'alpha_reputation': pragmatic_punisher.alpha_reputation}
+    return terms
+
+def get_cell(mixture, reputation_level, action, n, k, **labels):
+    # a cell of a dataset: k of n participants chose action, and the model probability of the action is the
+    # mixture (a dictionary from keys to weights) of the population averages of the keys at the reputation level
+    return dict(labels, mixture=mixture, reputation_level=reputation_level, action=action, n=int(n), k=int(k))
+
+def get_Jordan_Rand_2020_cells(all_data):
+    # the punishment cells of data/Jordan_Rand_2020/preprocess.py (studies 9 and 10), with unspecified (TG = 0)
+    # and observed (TG = 1) punishment modeled by low and high audience value. The punishers of the helping +
+    # punishment condition are a mixture of those who helped and did not help before, with the helping rate of the cell
+    data = all_data[(all_data['study']==9) | (all_data['study']==10)]
+    cells = []
+    for TG, level in [(0, 'low'), (1, 'high')]:
+        punish = data[(data['punonly']==1) & (data['TG']==TG)]['punish'].dropna()
+        cells.append(get_cell({'Punishment-only': 1}, level, 'Punish', len(punish), punish.sum(),
+                              IV='Punishment-only', TG=TG))
+    for TG, level in [(0, 'low'), (1, 'high')]:
+        cell_data = data[(data['condition']=='Punishment + Helping') & (data['helpfirst']==1) & (data['TG']==TG)]
+        punish = cell_data['punish'].dropna()
+        help_rate = cell_data['help'].mean()
+        cells.append(get_cell({'Both - H': help_rate, 'Both - NH': 1 - help_rate}, level, 'Punish', len(punish),
+                              punish.sum(), IV='Helping+Punishment', TG=TG))
+    return cells
+
+def get_Batistoni_2021_cells(data):
+    # the punishment cells of data/Batistoni_2021/preprocess.py, with the anonymous and observed third parties
+    # modeled by low and high audience value
+    punish_data = data[data['role']=='TP']
+    cells = []
+    for treat, level in [('Random / Anonymous', 'low'), ('Random / Knowledge', 'high')]:
+        punished = punish_data[punish_data['treat']==treat]['tp_invest'] > 0
+        cells.append(get_cell({'Punisher': 1}, level, 'Punish', len(punished), punished.sum(), treat=treat))
+    return cells
+
+def get_Rai_2021_exp1_cells(data):
+    # the cells of data/Rai_2021/exp1_data.csv, which only has the punishment rates and their standard errors; the
+    # number of participants is recovered from the binomial standard error
+    cells = []
+    for _, row in data.iterrows():
+        n = np.round(row['punish_prob'] * (1 - row['punish_prob']) / row['punish_prob_se']**2)
+        cells.append(get_cell({row['IV']: 1}, 'low', 'Punish', n, np.round(row['punish_prob'] * n), IV=row['IV']))
+    return cells
+
+def load_dataset(dataset, alpha_selfish_range, alpha_social_range):
+    # the model terms and the cells of a dataset
+    terms = {}
+    for config in get_configs(dataset):
+        terms.update(get_model_terms(config, alpha_selfish_range, alpha_social_range))
+    if dataset == 'Jordan_Rand_2020':
+        cells = get_Jordan_Rand_2020_cells(pd.read_csv('data/Jordan_Rand_2020/all_data.csv'))
+    elif dataset == 'Batistoni_2021':
+        cells = get_Batistoni_2021_cells(pd.read_csv('data/Batistoni_2021/all_data.csv'))
+    else:
+        data_preprocessor = importlib.import_module('data.Rai_2021.preprocess')
+        cells = get_Rai_2021_exp1_cells(data_preprocessor.preprocess(pd.read_csv('data/Rai_2021/exp1_data.csv')))
+    return terms, cells
+
+class Likelihood():
+    """
+    Negative log likelihood of the cells of a dataset and its gradient with respect to the log of the fitted
+    parameters; the parameters that are not fitted are fixed to their values in fixed
+    """
+    def __init__(self, dataset, terms, cells, alpha_selfish_range, alpha_social_range, parameters, fixed):
+        self.dataset = dataset
+        self.terms = terms
+        self.cells = cells
+        self.alpha_selfish_range = np.asarray(alpha_selfish_range, dtype=float)
+        alpha_social_weights = ALPHA_SOCIAL_PRIOR.pdf(np.asarray(alpha_social_range, dtype=float))
+        self.alpha_social_weights = alpha_social_weights / np.sum(alpha_social_weights)
+        self.parameters = list(parameters)
+        self.fixed = dict(fixed)
+        # the (key, reputation level) pairs whose population averages are needed by the cells
+        self.levels = list(dict.fromkeys((key, cell['reputation_level']) for cell in cells for key in cell['mixture']))
+        self.judgements = None      # the softmax_beta of the last audience judgements, the judgements and their derivatives
+        self.evaluations = 0
+        self.time = 0
+
+    def get_values(self, x):
+        # the values of all the parameters, from the log of the fitted ones
+        values = dict(self.fixed)
+        values.update({name: float(np.exp(x_i)) for name, x_i in zip(self.parameters, x)})
+        return values
+
+    def get_prior_weights(self, alpha_selfish_scale):
+        # the discretized exponential prior over alpha_selfish and its derivative with respect to the log scale
+        pdf = stats.expon(scale=alpha_selfish_scale).pdf(self.alpha_selfish_range)
+        weights = pdf / np.sum(pdf)
+        d_log_pdf = self.alpha_selfish_range / alpha_selfish_scale - 1
+        return weights, weights * (d_log_pdf - np.sum(weights * d_log_pdf))
+
+    def get_audience_judgements(self, softmax_beta):
+        # the audience judgements of all the keys at softmax_beta and their derivatives with respect to log
+        # softmax_beta. All the keys and levels of an evaluation share softmax_beta, so the judgements of the last
+        # softmax_beta are kept
+        if self.judgements is None or self.judgements[0] != softmax_beta:
+            P_legitimate = get_audience_judgements(self.dataset, softmax_beta)
+            if 'softmax_beta' in self.parameters:
+                P_up = get_audience_judgements(self.dataset, softmax_beta * np.exp(LOG_BETA_STEP))
+                P_down = get_audience_judgements(self.dataset, softmax_beta * np.exp(-LOG_BETA_STEP))
+                d_P_legitimate = {key: (P_up[key] - P_down[key]) / (2 * LOG_BETA_STEP) for key in P_legitimate}
+            else:
+                d_P_legitimate = {key: np.zeros_like(P) for key, P in P_legitimate.items()}
+            self.judgements = (softmax_beta, P_legitimate, d_P_legitimate)
+        return self.judgements[1], self.judgements[2]
+
+    def average_policy(self, key, level, values):
+        # population average policy of a key at a reputation level, with shape (n_actions,), and its derivatives
+        # with respect to the log of all the parameters, with shape (n_parameters, n_actions)
+        terms = self.terms[key]
+        beta = values['softmax_beta']
+        P_legitimate, d_P_legitimate = self.get_audience_judgements(beta)
+        multiplier = {'base': 0, 'low': values['low_reputation_ratio'], 'high': 1}[level]
+        U_reputation = values['alpha_reputation'] * multiplier * P_legitimate[key]
+        V = beta * (terms['U_base'] + U_reputation)
+        policy = softmax.softmax(V)
+
+        # derivative of the scaled utilities with respect to the log of each parameter; the one of softmax_beta
+        # includes the change of the audience judgement
+        d_V = {'softmax_beta': V + beta * values['alpha_reputation'] * multiplier * d_P_legitimate[key],
+               'alpha_reputation': beta * U_reputation,
+               'low_reputation_ratio': beta * U_reputation * (level == 'low')}
+        alpha_selfish_weights, d_alpha_selfish_weights = self.get_prior_weights(values['alpha_selfish_scale'])
+        average = np.einsum('ijk,i,j->k', policy, alpha_selfish_weights, self.alpha_social_weights)
+        d_average = []
+        for name in FIT_PARAMETERS:
+            if name == 'alpha_selfish_scale':
+                d_average.append(np.einsum('ijk,i,j->k', policy, d_alpha_selfish_weights, self.alpha_social_weights))
+            else:
+                d_V_name = np.broadcast_to(d_V[name], V.shape)
+                d_policy = policy * (d_V_name - np.sum(policy * d_V_name, axis=-1, keepdims=True))
+                d_average.append(np.einsum('ijk,i,j->k', d_policy, alpha_selfish_weights, self.alpha_social_weights))
+        return average, np.array(d_average)
+
+    def predict(self, values):
+        # model probability of the action of every cell, and its derivatives with respect to the log of all the
+        # parameters, with shape (n_parameters, n_cells)
+        averages = {level: self.average_policy(*level, values) for level in self.levels}
+        p = np.zeros(len(self.cells))
+        d_p = np.zeros((len(FIT_PARAMETERS), len(self.cells)))
+        for c, cell in enumerate(self.cells):
+            for key, weight in cell['mixture'].items():
+                average, d_average = averages[(key, cell['reputation_level'])]
+                a = self.terms[key]['available_actions'].index(cell['action'])
+                p[c] += weight * average[a]
+                d_p[:, c] += weight * d_average[:, a]
+        return p, d_p
+
+    def __call__(self, x):
+        start = time.perf_counter()
+        p, d_p = self.predict(self.get_values(x))
+        p = np.clip(p, 1e-12, 1 - 1e-12)
+        n = np.array([cell['n'] for cell in self.cells], dtype=float)
+        k = np.array([cell['k'] for cell in self.cells], dtype=float)
+        log_likelihood = np.sum(k * np.log(p) + (n - k) * np.log(1 - p))
+        d_log_likelihood = d_p @ (k / p - (n - k) / (1 - p))
+        gradient = np.array([d_log_likelihood[FIT_PARAMETERS.index(name)] for name in self.parameters])
+        self.evaluations += 1
+        self.time += time.perf_counter() - start
+        return -log_likelihood, -gradient
+
+def fit(dataset, parameters=FIT_PARAMETERS, initial=None, alpha_range=None, options=None):
+    # maximum-likelihood estimates of the parameters of the model on a dataset ('Jordan_Rand_2020', 'Batistoni_2021'
+    # or 'Rai_2021_exp1'), with L-BFGS-B and the analytic gradient of the likelihood. initial is a dictionary with
+    # the initial values of the fitted parameters and the values of the fixed ones; by default they are the values
+    # set in the config (and the prior and low/high ratio of the simulations). alpha_range is the grid of
+    # alpha_selfish and alpha_social values, np.arange(0,10,0.1) by default
+    alpha_range = np.arange(0, 10, 0.1) if alpha_range is None else np.asarray(alpha_range)
+    start = time.perf_counter()
+    terms, cells = load_dataset(dataset, alpha_range, alpha_range)
+    setup_time = time.perf_counter() - start
+
+    key = next(iter(cells[0]['mixture']))
+    values = {'softmax_beta': terms[key]['softmax_beta'],
+              'alpha_reputation': terms[key]['alpha_reputation'],
+              'low_reputation_ratio': simulate_model.LOW_REPUTATION_RATIO,
+              'alpha_selfish_scale': 3.0}
+    values.update(initial or {})
+    likelihood = Likelihood(dataset, terms, cells, alpha_range, alpha_range, parameters, values)
+    x0 = np.log([values[name] for name in parameters])
+    initial_log_likelihood = -likelihood(x0)[0]
+
+    start = time.perf_counter()
+    result = optimize.minimize(likelihood, x0, jac=True, method='L-BFGS-B', options=options)
+    fit_time = time.perf_counter() - start
+
+    estimates = likelihood.get_values(result.x)
+    p, _ = likelihood.predict(estimates)
+    return {'dataset': dataset,
+            'parameters': list(parameters),
+            'initial': values,
+            'estimates': estimates,
+            'initial_log_likelihood': float(initial_log_likelihood),
+            'log_likelihood': float(-result.fun),
+            'cells': [dict(cell, rate=cell['k'] / cell['n'], prediction=float(p_c)) for cell, p_c in zip(cells, p)],
+            'success': bool(result.success),
+            'message': str(result.message),
+            'iterations': int(result.nit),
+            'evaluations': likelihood.evaluations,
+            'setup_time': setup_time,
+            'fit_time': fit_time,
+            'likelihood_time': likelihood.time}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the parameters of the model to the experimental data by maximum likelihood")
+    parser.add_argument('dataset', choices=['Jordan_Rand_2020', 'Batistoni_2021', 'Rai_2021_exp1'])
+    parser.add_argument('--parameters', nargs='+', choices=FIT_PARAMETERS, default=FIT_PARAMETERS,
+                        help="the parameters to fit; the others are fixed to their values in the config")
+    parser.add_argument('--resolution', type=float, default=0.1, help="step size of the alpha_selfish and alpha_social grid")
+    parser.add_argument('--output', help="json file to write the results to")
+    args = parser.parse_args()
+
+    results = fit(args.dataset, args.parameters, alpha_range=np.arange(0, 10, args.resolution))
+    print(tabulate([[name, results['initial'][name], results['estimates'][name], name in results['parameters']]
+                    for name in FIT_PARAMETERS], headers=["Parameter", "Initial", "Estimate", "Fitted"]))
+    print(f"log likelihood: {results['initial_log_likelihood']:.2f} -> {results['log_likelihood']:.2f} "
+          f"({results['message']})")
+    print(f"{results['evaluations']} evaluations in {results['fit_time']:.3f} s "
+          f"({results['likelihood_time']:.3f} s in the likelihood, {results['setup_time']:.3f} s of setup)")
+    if args.output is not None:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, default=float)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import importlib
+import time
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import simulate_model
+import simulate_Jordan_model
+import simulate_population
+from utils import joint_density
+from utils import softmax
+from utils import policy_store as policy_stores
+
+# Posterior over the (alpha_selfish, alpha_social) type of every participant of an experiment, given their choices.
+# This is the inference of the audience (the log posterior is the log prior plus the log policy of each observed
+# action, normalized with log-sum-exp), but with the population prior and the per-type policies of the policy store
+# of simulate, and for all the participants at once: every observed (key, reputation level, action) is a column of
+# log policies over the grid, every participant is a row of counts of the columns they were observed in, and the log
+# likelihood of all the participants is one matrix product of the two. Participants with the same observations have
+# the same posterior, so it is computed once for each distinct row of counts.
+
+# the smallest log probability of an action, so that the types that cannot choose an observed action still have a
+# finite log likelihood (a policy can underflow to 0 for extreme utilities)
+MIN_LOG_PROBABILITY = np.log(np.finfo(float).tiny)
+
+# the action of each value of the help and punish columns of data/Jordan_Rand_2020/all_data.csv
+JORDAN_COLUMN_ACTIONS = {'help': {0: 'Not-help', 1: 'Help'}, 'punish': {0: 'Not-punish', 1: 'Punish'}}
+
+# the treatments of data/Batistoni_2021/all_data.csv that are modeled, with the reputation level of each
+BATISTONI_REPUTATION_LEVELS = {'Random / Anonymous': 'low', 'Random / Knowledge': 'high'}
+
+# the key of the punishment severity decision (the 'Punisher' of configs/paper/Batistoni_2021/exp1_stage2_audience1)
+# in the policy store, where it is relabelled so that it does not collide with the 'Punisher' of stage 1
+BATISTONI_SEVERITY_KEY = 'Punisher - severity'
+
+# the actions of the punishment severity decision, the percentage of the endowment invested in punishment
+BATISTONI_SEVERITY_ACTIONS = np.arange(10, 101, 10)
+
+class Observations():
+    """
+    Counts of the observations of every participant, with shape (n_participants, n_columns), where each column
+    is a (key, reputation level, action)
+    """
+    def __init__(self, n_participants, index=None):
+        self.columns = []
+        self.column_index = {}
+        self.counts = []        # one array of counts over the participants for each column
+        self.n_participants = n_participants
+        self.index = index      # the index of the participants in the data
+
+    def add(self, participants, key, level, action):
+        # add one observation of action in key at the reputation level to the participants, a boolean mask
+        column = (key, level, action)
+        if column not in self.column_index:
+            self.column_index[column] = len(self.columns)
+            self.columns.append(column)
+            self.counts.append(np.zeros(self.n_participants, dtype=int))
+        self.counts[self.column_index[column]] += np.asarray(participants, dtype=int)
+
+    def get_counts(self):
+        return np.stack(self.counts, axis=-1) if self.counts else np.zeros((self.n_participants, 0), dtype=int)
+
+def get_Jordan_Rand_2020_observations(all_data, studies=(9, 10), design=simulate_population.JORDAN_DESIGN,
+                                      reputation_levels=simulate_population.JORDAN_REPUTATION_LEVELS):
+    # the help and punish choices of the participants of the studies. The key of a decision that depends on the
+    # previous decision is that of the observed previous action; if the previous choice is missing, the decision
+    # is left out
+    trial_likelihood = importlib.import_module('data.Jordan_Rand_2020.trial_likelihood')
+    data = trial_likelihood.get_design_conditions(all_data, studies, design)
+    observations = Observations(len(data), data.index)
+    for TG, level in reputation_levels.items():
+        for condition, spec in design.items():
+            participants = ((data['design_condition'] == condition) & (data['TG'] == TG)).to_numpy()
+            previous_column = None
+            for column, key in spec['decisions']:
+                keys = key if isinstance(key, dict) else {None: key}
+                for previous_action, key in keys.items():
+                    decided = participants.copy()
+                    if previous_action is not None:
+                        previous_value = simulate_population.JORDAN_ACTION_VALUES[previous_action]
+                        decided &= (data[previous_column] == previous_value).to_numpy()
+                    for value, action in JORDAN_COLUMN_ACTIONS[column].items():
+                        observations.add(decided & (data[column] == value).to_numpy(), key, level, action)
+                previous_column = column
+    return observations
+
+def get_Batistoni_severity_actions(tp_invest_perc, actions=BATISTONI_SEVERITY_ACTIONS):
+    # the severity action of each percentage of the endowment invested in punishment, with the bins of
+    # data/Batistoni_2021/preprocess_severity.py: the action a is the bin [a - 10, a), and 100% is action 100
+    action = 10 * np.floor(np.asarray(tp_invest_perc, dtype=float) / 10) + 10
+    return np.clip(action, actions[0], actions[-1]).astype(int)
+
+def get_Batistoni_2021_observations(data, reputation_levels=BATISTONI_REPUTATION_LEVELS, key='Punisher',
+                                    severity_key=BATISTONI_SEVERITY_KEY):
+    # the punishment decisions (whether tp_invest is positive) of the third parties of the modeled treatments, and
+    # the punishment severity (tp_invest_perc) of those who punished
+    data = data[(data['role'] == 'TP') & data['treat'].isin(list(reputation_levels.keys()))]
+    observations = Observations(len(data), data.index)
+    punished = (data['tp_invest'] > 0).to_numpy()
+    severity = get_Batistoni_severity_actions(data['tp_invest_perc'])
+    for treat, level in reputation_levels.items():
+        participants = (data['treat'] == treat).to_numpy()
+        observations.add(participants & punished, key, level, 'Punish')
+        observations.add(participants & ~punished, key, level, 'Not-punish')
+        for action in BATISTONI_SEVERITY_ACTIONS.tolist():
+            observations.add(participants & punished & (severity == action), severity_key, level, action)
+    return observations
+
+def get_log_policies(policy_store, columns):
+    # log policy of each (key, reputation level, action) column for every type, with shape
+    # (n_columns, n_selfish, n_social)
+    log_policies = []
+    for key, level, action in columns:
+        policy = policy_store.sel(key=key, reputation_level=level, action=action).values
+        with np.errstate(divide='ignore'):
+            log_policies.append(np.maximum(np.log(policy), MIN_LOG_PROBABILITY))
+    return np.array(log_policies)
+
+def infer_log_posterior(policy_store, alpha_prior, observations):
+    # log posterior over the types for each distinct row of counts of the observations, with shape
+    # (n_distinct, n_selfish, n_social), and the index of the distinct row of every participant
+    counts, participant_rows = np.unique(observations.get_counts(), axis=0, return_inverse=True)
+    log_policies = get_log_policies(policy_store, observations.columns)
+    grid_shape = np.shape(alpha_prior)
+    with np.errstate(divide='ignore'):
+        log_prior = np.log(np.asarray(alpha_prior, dtype=float)).ravel()
+    log_likelihood = counts @ log_policies.reshape(len(observations.columns), -1)
+    log_posterior = softmax.log_normalize(log_likelihood + log_prior, axis=-1)
+    return log_posterior.reshape((len(counts),) + grid_shape), np.ravel(participant_rows)
+
+def infer_posterior(policy_store, alpha_prior, observations, dtype=float):
+    # posterior over the types of every participant, with shape (n_participants, n_selfish, n_social). With the
+    # default 0.1 grid this takes n_participants * 10000 values, so dtype can be np.float32 to halve the memory
+    log_posterior, participant_rows = infer_log_posterior(policy_store, alpha_prior, observations)
+    return np.exp(log_posterior).astype(dtype, copy=False)[participant_rows]
+
+def posterior_summary(policy_store, alpha_prior, observations):
+    # the posterior mean and standard deviation of alpha_selfish and alpha_social of every participant, as a data
+    # frame indexed like the data, computed from the distinct posteriors without building the full posterior array
+    log_posterior, participant_rows = infer_log_posterior(policy_store, alpha_prior, observations)
+    posterior = np.exp(log_posterior)
+    summary = {}
+    for name, axis in [('alpha_selfish', 2), ('alpha_social', 1)]:
+        alpha = np.asarray(policy_store.axes[name], dtype=float)
+        marginal = np.sum(posterior, axis=axis)
+        mean = marginal @ alpha
+        summary[f'{name}_mean'] = mean[participant_rows]
+        summary[f'{name}_sd'] = np.sqrt(np.maximum(marginal @ alpha**2 - mean**2, 0))[participant_rows]
+    return pd.DataFrame(summary, index=observations.index)
+
+def simulate_dataset(dataset, alpha_range):
+    # the policy store of the model of a dataset and the discretized population prior, as in model_simulation_plots.ipynb
+    alpha_prior = joint_density.JointIndependent([stats.expon(scale=1/(1/3)),   # prior over alpha_selfish
+                                                  stats.uniform(0, 10)])  # prior over alpha_social
+    alpha_prior_discretized = alpha_prior.discretize([alpha_range, alpha_range])
+    with contextlib.redirect_stdout(io.StringIO()):
+        if dataset == 'Jordan_Rand_2020':
+            model_data = simulate_Jordan_model.simulate('paper.Jordan_Rand_2020.only_condition_audience1',
+                                                        'paper.Jordan_Rand_2020.both_condition_audience1',
+                                                        save=False, alpha_range=alpha_range)
+        else:
+            # the punishment decision (stage 1) and the punishment severity decision (stage 2), whose key is
+            # relabelled before the two stores are concatenated
+            stores = []
+            for stage, keys in [('stage1', {}), ('stage2', {'Punisher': BATISTONI_SEVERITY_KEY})]:
+                config_name = f'paper.Batistoni_2021.exp1_{stage}_audience1'
+                config = importlib.import_module(f'configs.{config_name}').get_config()
+                available_actions = {key: config[key]['available_actions'] for key in config.keys()}
+                params = {'available_actions': available_actions,
+                          'alpha_selfish_set': {key: alpha_range for key in config.keys()},
+                          'alpha_social_set': {key: alpha_range for key in config.keys()},
+                          'alpha_target': {key: config[key]['alpha_target'] for key in config.keys()},
+                          'alpha_prior': alpha_prior_discretized}
+                store = simulate_model.simulate(config_name, config, params, save=False)['policy_store']
+                stores.append(policy_stores.PolicyStore(store.values, dict(store.axes, key=[keys.get(key, key)
+                                                                                         for key in store.axes['key']])))
+            return policy_stores.PolicyStore.concatenate(stores), alpha_prior_discretized
+    return model_data['policy_store'], alpha_prior_discretized
+
+def main():
+    parser = argparse.ArgumentParser(description="Infer the posterior over the types of every participant of an experiment")
+    parser.add_argument('dataset', choices=['Jordan_Rand_2020', 'Batistoni_2021'])
+    parser.add_argument('--resolution', type=float, default=0.1, help="step size of the alpha_selfish and alpha_social grid")
+    parser.add_argument('--output', help="csv file to write the posterior mean and sd of every participant to")
+    args = parser.parse_args()
+
+    policy_store, alpha_prior = simulate_dataset(args.dataset, np.arange(0, 10, args.resolution))
+    start = time.perf_counter()
+    if args.dataset == 'Jordan_Rand_2020':
+        observations = get_Jordan_Rand_2020_observations(pd.read_csv('data/Jordan_Rand_2020/all_data.csv'))
+    else:
+        observations = get_Batistoni_2021_observations(pd.read_csv('data/Batistoni_2021/all_data.csv'))
+    summary = posterior_summary(policy_store, alpha_prior, observations)
+    print(f"{observations.n_participants} participants, {len(observations.columns)} observed actions, "
+          f"{time.perf_counter() - start:.3f} s")
+    print(summary.describe())
+    if args.output is not None:
+        summary.to_csv(args.output)
+
+if __name__ == '__main__':
+    main()
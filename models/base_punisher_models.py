@@ -1,6 +1,10 @@
 
 import numpy as np
 
+from utils import softmax
+from utils import instrumentation
+from utils import random_streams
+
 class BasePunisher():
     def __init__(self,
                  alpha_selfish,
@@ -25,18 +29,74 @@ class BasePunisher():
         U_total = self.alpha_selfish * U_selfish + self.alpha_social * U_social + self.alpha_target * U_target
         return U_total
 
+    @instrumentation.instrumented('BasePunisher.policy')
     def policy(self, available_actions):
-        policy = {a: None for a in available_actions}
-        for action in available_actions:
-            U_total = self.get_utility(action)
-            policy[action] = np.exp(self.softmax_beta * U_total)
+        U_total = np.array([self.get_utility(action) for action in available_actions], dtype=float)
+        normalized_policy = dict(zip(available_actions, softmax.softmax(self.softmax_beta * U_total)))
+        return normalized_policy
+
+    def get_utility_arrays(self, available_actions):
+        # utilities of the available actions as arrays, in the order of available_actions
+        U_selfish = np.array([self.selfish_utilities[a] for a in available_actions], dtype=float)
+        U_social = np.array([self.social_utilities[a] for a in available_actions], dtype=float)
+        U_target = np.array([self.target_utilities[a] for a in available_actions], dtype=float)
+        return U_selfish, U_social, U_target
+
+    def batch_utility(self, available_actions, alpha_selfish, alpha_social, alpha_target=None):
+        # utility of every action for the whole (alpha_selfish, alpha_social) grid at once,
+        # with shape (n_selfish, n_social, n_actions).
+        # alpha_target can be a scalar or an array broadcastable to (n_selfish, n_social);
+        # if it is None, the alpha_target of the punisher is used
+        if alpha_target is None:
+            alpha_target = self.alpha_target
+        alpha_selfish = np.asarray(alpha_selfish, dtype=float)[:, None, None]
+        alpha_social = np.asarray(alpha_social, dtype=float)[None, :, None]
+        alpha_target = np.asarray(alpha_target, dtype=float)[..., None]
+        U_selfish, U_social, U_target = self.get_utility_arrays(available_actions)
+        U_total = alpha_selfish * U_selfish + alpha_social * U_social + alpha_target * U_target
+        return U_total
 
-        normalized_policy = {a: policy[a]/np.sum(list(policy.values())) for a in available_actions}
+    @instrumentation.instrumented('BasePunisher.batch_policy')
+    def batch_policy(self, available_actions, alpha_selfish, alpha_social, alpha_target=None):
+        # policy of every (alpha_selfish, alpha_social) punisher on the grid, computed in one
+        # broadcasted softmax; returns an array of shape (n_selfish, n_social, n_actions)
+        U_total = self.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        normalized_policy = softmax.softmax(self.softmax_beta * U_total)
         return normalized_policy
 
-    def decide(self, available_actions):
+    @instrumentation.instrumented('BasePunisher.batch_log_policy')
+    def batch_log_policy(self, available_actions, alpha_selfish, alpha_social, alpha_target=None):
+        # log of the policy of every (alpha_selfish, alpha_social) punisher on the grid, computed with log-sum-exp;
+        # returns an array of shape (n_selfish, n_social, n_actions)
+        U_total = self.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        log_policy = softmax.log_softmax(self.softmax_beta * U_total)
+        return log_policy
+
+    @instrumentation.instrumented('BasePunisher.sweep_policy')
+    def sweep_policy(self, available_actions, alpha_selfish, alpha_social, softmax_beta, alpha_target):
+        # policy on the (alpha_selfish, alpha_social) grid for arrays of softmax_beta and alpha_target values,
+        # with shape (n_beta, n_target, n_selfish, n_social, n_actions)
+        softmax_beta = np.asarray(softmax_beta, dtype=float)[:, None, None, None, None]
+        alpha_target = np.asarray(alpha_target, dtype=float)[:, None, None]
+        U_total = self.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        normalized_policy = softmax.softmax(softmax_beta * U_total[None])
+        return normalized_policy
+
+    @instrumentation.instrumented('BasePunisher.sweep_log_policy')
+    def sweep_log_policy(self, available_actions, alpha_selfish, alpha_social, softmax_beta, alpha_target):
+        # log of the policy of sweep_policy, computed with log-sum-exp; with shape
+        # (n_beta, n_target, n_selfish, n_social, n_actions)
+        softmax_beta = np.asarray(softmax_beta, dtype=float)[:, None, None, None, None]
+        alpha_target = np.asarray(alpha_target, dtype=float)[:, None, None]
+        U_total = self.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        log_policy = softmax.log_softmax(softmax_beta * U_total[None])
+        return log_policy
+
+    def decide(self, available_actions, rng=None):
+        # rng can be a numpy Generator, a SeedSequence or an integer seed; if None, the global numpy random state is used
         policy = self.policy(available_actions)
-        current_action_idx = np.argwhere(np.random.multinomial(1, policy.value()))[0][0]
+        rng = random_streams.get_generator(rng)
+        current_action_idx = np.argwhere(rng.multinomial(1, list(policy.values())))[0][0]
         current_action = available_actions[current_action_idx]
         return current_action
 
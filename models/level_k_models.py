@@ -0,0 +1,71 @@
+import numpy as np
+
+from utils import softmax
+
+class LevelKPunisher():
+    """
+    Pragmatic punisher with an arbitrary depth of pragmatism. The level 0 punisher is the base
+    punisher, the level k audience judges the level k punisher, and the level k+1 punisher adds the
+    reputation utility of the level k audience judgement to the base utility. Every level is computed
+    once and reused by the next one, so the cost grows linearly with the depth. alpha_reputation is the
+    one of the punisher on the grid, and inner_alpha_reputation (alpha_reputation by default) is the one
+    of the punishers that the audiences reason about, as in a PragmaticPunisher whose audience reasons
+    about a punisher of another config
+    """
+    def __init__(self,
+                 depth,
+                 alpha_reputation,
+                 base_punisher,
+                 base_punisher_kwargs,
+                 audience,
+                 audience_kwargs,
+                 inner_alpha_reputation=None):
+        self.depth = depth
+        self.alpha_reputation = alpha_reputation
+        self.inner_alpha_reputation = alpha_reputation if inner_alpha_reputation is None else inner_alpha_reputation
+        self.base_punisher = base_punisher(**base_punisher_kwargs)
+        self.audience = audience(**audience_kwargs)
+        # the level 0 punisher model that the audience reasons about
+        self.audience_punisher_model = self.audience.punisher_model(**self.audience.punisher_model_kwargs)
+
+    @classmethod
+    def from_config(cls, config, depth, alpha_reputation=None):
+        # build the level-k punisher from the 'pragmatic_punisher' entry of a config file. alpha_reputation
+        # only replaces the one of the punisher on the grid: the punishers that the audiences reason about keep
+        # the alpha_reputation of the config, as the nested pragmatic punisher of the 'pragmatic_audience' entry
+        kwargs = dict(config['pragmatic_punisher']['kwargs'])
+        kwargs['inner_alpha_reputation'] = kwargs['alpha_reputation']
+        if alpha_reputation is not None:
+            kwargs['alpha_reputation'] = alpha_reputation
+        return cls(depth=depth, **kwargs)
+
+    def solve(self, available_actions, alpha_selfish=None, alpha_social=None, alpha_target=None):
+        # returns a list with the levels 0..depth; the entry of level k contains the policy of the level k
+        # punisher for every audience type, the posterior of the level k audience, its legitimacy judgement,
+        # and the policy of the level k punisher on the (alpha_selfish, alpha_social) grid if it is given
+        type_alpha_selfish, type_alpha_social = self.audience.get_type_arrays()
+        U_type_base = self.audience_punisher_model.batch_utility(available_actions, type_alpha_selfish,
+                                                                 type_alpha_social, self.audience.alpha_target)
+        if alpha_selfish is not None:
+            U_base = self.base_punisher.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+
+        levels = []
+        P_legitimate = np.zeros(len(available_actions))
+        for k in range(self.depth + 1):
+            # the level 0 punisher does not care about its reputation
+            inner_alpha_reputation = 0 if k == 0 else self.inner_alpha_reputation
+            level = {}
+            type_log_policy = softmax.log_softmax(self.audience_punisher_model.get_softmax_beta() *
+                                                  (U_type_base + inner_alpha_reputation * P_legitimate))
+            level['type_policy'] = np.exp(type_log_policy)
+            if alpha_selfish is not None:
+                alpha_reputation = 0 if k == 0 else self.alpha_reputation
+                level['policy'] = softmax.softmax(self.base_punisher.get_softmax_beta() *
+                                                  (U_base + alpha_reputation * P_legitimate))
+            level['alpha_posterior'] = np.exp(self.audience.log_posterior_from_log_likelihood(type_log_policy,
+                                                                                              available_actions))
+            P_legitimate = self.audience.legitimacy_from_posterior(level['alpha_posterior'])
+            level['P_legitimate'] = dict(zip(available_actions, P_legitimate))
+            levels.append(level)
+
+        return levels
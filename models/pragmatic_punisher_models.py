@@ -2,7 +2,62 @@
 import numpy as np
 import collections
 
+from utils import fingerprint
+from utils import softmax
+from utils import instrumentation
+from utils import random_streams
+
+class JudgementCache():
+    """
+    Bounded (least recently used) cache of audience judgements, keyed by the set of available
+    actions and the parameters of the audience, including the parameters of the punisher model
+    the audience reasons about
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.judgements = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.judgements:
+            self.hits += 1
+            instrumentation.count('JudgementCache.hits')
+            self.judgements.move_to_end(key)
+            return self.judgements[key]
+        self.misses += 1
+        instrumentation.count('JudgementCache.misses')
+        return None
+
+    def put(self, key, judgement):
+        self.judgements[key] = judgement
+        self.judgements.move_to_end(key)
+        while len(self.judgements) > self.maxsize:
+            self.judgements.popitem(last=False)
+
+    def invalidate(self, audience_key=None):
+        # remove the judgements of one audience, or all the judgements if audience_key is None
+        if audience_key is None:
+            self.judgements.clear()
+        else:
+            for key in [key for key in self.judgements if key[1] == audience_key]:
+                del self.judgements[key]
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.judgements), 'maxsize': self.maxsize}
+
+    def cache_clear(self):
+        self.judgements.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 class PragmaticPunisher():
+    # the judgement of the audience does not depend on the alpha_selfish and alpha_social of the
+    # pragmatic punisher, so it is shared by all the pragmatic punishers with the same audience
+    judgement_cache = JudgementCache()
+
     def __init__(self,
                  alpha_reputation,
                  base_punisher,
@@ -13,46 +68,133 @@ class PragmaticPunisher():
         self.audience = audience(**audience_kwargs)
         self.alpha_reputation = alpha_reputation
         self.P_legitimate = None       # judgements of audience about illegitimacy of punisher's actions
+        self.audience_key = None       # fingerprint of the audience parameters, used as part of the judgement cache key
+
+    def get_audience_key(self):
+        if self.audience_key is None:
+            self.audience_key = (type(self.audience).__module__, type(self.audience).__qualname__,
+                                 fingerprint.freeze(vars(self.audience)))
+        return self.audience_key
 
+    def invalidate_audience_judgement(self):
+        # should be called if the parameters of the audience (or of the punisher model that the
+        # audience reasons about) are changed after the pragmatic punisher is instantiated
+        self.judgement_cache.invalidate(self.get_audience_key())
+        self.audience_key = None
+        self.P_legitimate = None
+
+    @instrumentation.instrumented('PragmaticPunisher.simulate_audience_judgement')
     def simulate_audience_judgement(self, available_actions=None):
         if available_actions is None:
-            self.P_legitimate = self.audience.judge_legitimacy(self.available_actions)
-        else:
-            self.P_legitimate = self.audience.judge_legitimacy(available_actions)
+            available_actions = self.available_actions
+        key = (tuple(available_actions), self.get_audience_key())
+        P_legitimate = self.judgement_cache.get(key)
+        if P_legitimate is None:
+            P_legitimate = self.audience.judge_legitimacy(available_actions)
+            self.judgement_cache.put(key, P_legitimate)
+        self.P_legitimate = P_legitimate
         return self.P_legitimate
 
+    @instrumentation.instrumented('PragmaticPunisher.sweep_audience_judgement')
+    def sweep_audience_judgement(self, available_actions, softmax_beta, alpha_target):
+        # judgement of the audience for arrays of softmax_beta and alpha_target values of the punisher model that the
+        # audience reasons about (alpha_target is also that of the audience), as if they were set in the config;
+        # with shape (n_beta, n_target, n_actions)
+        softmax_beta = np.asarray(softmax_beta, dtype=float)
+        alpha_target = np.asarray(alpha_target, dtype=float)
+        key = (tuple(available_actions), self.get_audience_key(), tuple(softmax_beta.tolist()), tuple(alpha_target.tolist()))
+        P_legitimate = self.judgement_cache.get(key)
+        if P_legitimate is None:
+            P_legitimate = self.audience.sweep_judge_legitimacy(available_actions, softmax_beta, alpha_target)
+            self.judgement_cache.put(key, P_legitimate)
+        return P_legitimate
+
+    @instrumentation.instrumented('PragmaticPunisher.get_utility')
     def get_utility(self, action):
-        # TODO: think more about this to see whether it's ok to find P_legitimate only once
-        # and use it for whatever function calls to get_utility of pragmatic punisher with
-        # whatever pragmatism depth
-        if self.P_legitimate is None:
-            # if the pragmatic punisher has never calculated this before
-            self.simulate_audience_judgement()
-        else:
-            # or the pragmatic punisher now wants to calculate this for another set of available actions
-            if collections.Counter(list(self.P_legitimate.keys())) != collections.Counter(self.available_actions):
-                self.simulate_audience_judgement()
+        # P_legitimate does not depend on alpha_selfish, alpha_social and alpha_target of the
+        # pragmatic punisher, so it is looked up in the judgement cache with whatever pragmatism depth
+        self.simulate_audience_judgement()
         U_base_punisher = self.base_punisher.get_utility(action)
         U_reputation = self.P_legitimate[action]
         U_total = U_base_punisher + self.alpha_reputation * U_reputation
         return U_total
 
+    @instrumentation.instrumented('PragmaticPunisher.policy')
     def policy(self, available_actions):
         self.available_actions = available_actions
-        policy = {a: None for a in available_actions}
-        for action in available_actions:
-            U_total = self.get_utility(action)
-            policy[action] = np.exp(self.get_softmax_beta() * U_total)
+        U_total = np.array([self.get_utility(action) for action in available_actions], dtype=float)
+        normalized_policy = dict(zip(available_actions, softmax.softmax(self.get_softmax_beta() * U_total)))
+        return normalized_policy
 
-        normalized_policy = {a: policy[a]/np.sum(list(policy.values())) for a in available_actions}
+    def batch_utility(self, available_actions, alpha_selfish, alpha_social, alpha_target=None):
+        # the audience judgement does not depend on alpha_selfish and alpha_social of the punisher,
+        # so it is simulated once and broadcast over the whole grid
+        self.available_actions = available_actions
+        self.simulate_audience_judgement(available_actions)
+        U_base_punisher = self.base_punisher.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        U_reputation = np.array([self.P_legitimate[a] for a in available_actions], dtype=float)
+        U_total = U_base_punisher + self.alpha_reputation * U_reputation
+        return U_total
+
+    @instrumentation.instrumented('PragmaticPunisher.batch_policy')
+    def batch_policy(self, available_actions, alpha_selfish, alpha_social, alpha_target=None):
+        # policy of every (alpha_selfish, alpha_social) punisher on the grid, computed in one
+        # broadcasted softmax; returns an array of shape (n_selfish, n_social, n_actions)
+        U_total = self.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        normalized_policy = softmax.softmax(self.get_softmax_beta() * U_total)
         return normalized_policy
 
-    def decide(self, available_actions):
+    @instrumentation.instrumented('PragmaticPunisher.batch_log_policy')
+    def batch_log_policy(self, available_actions, alpha_selfish, alpha_social, alpha_target=None):
+        # log of the policy of every (alpha_selfish, alpha_social) punisher on the grid, computed with log-sum-exp;
+        # returns an array of shape (n_selfish, n_social, n_actions)
+        U_total = self.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        log_policy = softmax.log_softmax(self.get_softmax_beta() * U_total)
+        return log_policy
+
+    def sweep_utility(self, available_actions, alpha_selfish, alpha_social, alpha_reputation, softmax_beta, alpha_target):
+        # utility on the (alpha_selfish, alpha_social) grid for arrays of alpha_reputation, softmax_beta and
+        # alpha_target values, with shape (n_reputation, n_beta, n_target, n_selfish, n_social, n_actions).
+        # softmax_beta and alpha_target are also those of the punisher model of the audience, so the audience
+        # judgement is simulated for each of their combinations
+        U_reputation = self.sweep_audience_judgement(available_actions, softmax_beta, alpha_target)[None, :, :, None, None, :]
+        alpha_reputation = np.asarray(alpha_reputation, dtype=float)[:, None, None, None, None, None]
+        alpha_target = np.asarray(alpha_target, dtype=float)[:, None, None]
+        U_base_punisher = self.base_punisher.batch_utility(available_actions, alpha_selfish, alpha_social, alpha_target)
+        U_total = U_base_punisher[None, None] + alpha_reputation * U_reputation
+        return U_total
+
+    @instrumentation.instrumented('PragmaticPunisher.sweep_policy')
+    def sweep_policy(self, available_actions, alpha_selfish, alpha_social, alpha_reputation, softmax_beta, alpha_target):
+        # policy on the (alpha_selfish, alpha_social) grid for arrays of alpha_reputation, softmax_beta and
+        # alpha_target values, with shape (n_reputation, n_beta, n_target, n_selfish, n_social, n_actions)
+        U_total = self.sweep_utility(available_actions, alpha_selfish, alpha_social, alpha_reputation, softmax_beta, alpha_target)
+        softmax_beta = np.asarray(softmax_beta, dtype=float)[None, :, None, None, None, None]
+        normalized_policy = softmax.softmax(softmax_beta * U_total)
+        return normalized_policy
+
+    @instrumentation.instrumented('PragmaticPunisher.sweep_log_policy')
+    def sweep_log_policy(self, available_actions, alpha_selfish, alpha_social, softmax_beta, alpha_target):
+        # log of the policy of sweep_policy with the alpha_reputation of the pragmatic punisher, computed with
+        # log-sum-exp; with shape (n_beta, n_target, n_selfish, n_social, n_actions), as the sweep_log_policy of
+        # BasePunisher, so that an audience can reason about a pragmatic punisher in a sweep
+        U_total = self.sweep_utility(available_actions, alpha_selfish, alpha_social, [self.alpha_reputation],
+                                     softmax_beta, alpha_target)[0]
+        softmax_beta = np.asarray(softmax_beta, dtype=float)[:, None, None, None, None]
+        log_policy = softmax.log_softmax(softmax_beta * U_total)
+        return log_policy
+
+    def decide(self, available_actions, rng=None):
+        # rng can be a numpy Generator, a SeedSequence or an integer seed; if None, the global numpy random state is used
         policy = self.policy(available_actions)
-        current_action_idx = np.argwhere(np.random.multinomial(1, policy.value()))[0][0]
+        rng = random_streams.get_generator(rng)
+        current_action_idx = np.argwhere(rng.multinomial(1, list(policy.values())))[0][0]
         current_action = available_actions[current_action_idx]
         return current_action
 
+    # note that the audience reasons about its own punisher model, so changing the alphas of the
+    # pragmatic punisher does not change the audience judgement and does not invalidate the cache
+
     def set_alpha_selfish(self, alpha_selfish):
         # this is a recursive function that calls the set_alpha_selfish on the tree
         # of base_punishers until it hits the punisher agent that has the alpha_selfish in it
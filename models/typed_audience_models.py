@@ -1,5 +1,10 @@
 
 import numpy as np
+import itertools
+
+from utils import softmax
+from utils import fingerprint
+from utils import instrumentation
 
 class Audience():
     def __init__(self,
@@ -16,39 +21,100 @@ class Audience():
         self.alpha_social_set = alpha_social_set
         self.alpha_target = alpha_target    # TODO: makes this general, so that we can have different type_targets with different alpha_targets as well
 
-    def infer_posterior(self, available_actions):
+    def get_type_arrays(self):
+        # the alpha values of the agent types, in the order of the keys of alpha_selfish_set and alpha_social_set
+        alpha_selfish = np.array(list(self.alpha_selfish_set.values()), dtype=float)
+        alpha_social = np.array(list(self.alpha_social_set.values()), dtype=float)
+        return alpha_selfish, alpha_social
+
+    def get_prior_array(self, available_actions):
+        # prior over agent types with shape (n_selfish_types, n_social_types, n_actions);
+        # the prior can be different for each action if alpha_prior is a dictionary of priors
+        types = list(itertools.product(self.alpha_selfish_set.keys(), self.alpha_social_set.keys()))
+        shape = (len(self.alpha_selfish_set), len(self.alpha_social_set))
+        if type(self.alpha_prior) is dict:
+            prior = np.stack([self.alpha_prior[action].pmf_batch(types).reshape(shape)
+                              for action in available_actions], axis=-1)
+        else:
+            prior = np.repeat(self.alpha_prior.pmf_batch(types).reshape(shape + (1,)), len(available_actions), axis=-1)
+        return prior
+
+    def get_likelihood_array(self, available_actions):
+        # policy of the punisher model for every agent type, with shape (n_selfish_types, n_social_types, n_actions)
+        return np.exp(self.get_log_likelihood_array(available_actions))
+
+    @instrumentation.instrumented('Audience.get_log_likelihood_array')
+    def get_log_likelihood_array(self, available_actions):
+        # log policy of the punisher model for every agent type, with shape (n_selfish_types, n_social_types, n_actions)
         punisher_model = self.punisher_model(**self.punisher_model_kwargs)
-        punisher_policies = {(type_selfish, type_social): None
-                             for type_selfish, type_social in zip(self.alpha_selfish_set.keys(), self.alpha_social_set.keys())}
-        for type_selfish, alpha_selfish in self.alpha_selfish_set.items():
-            for type_social, alpha_social in self.alpha_social_set.items():
-                punisher_model.set_alpha_selfish(alpha_selfish)
-                punisher_model.set_alpha_social(alpha_social)
-                punisher_model.set_alpha_target(self.alpha_target)
-                policy = punisher_model.policy(available_actions)
-                punisher_policies[(type_selfish, type_social)] = policy
-
-        alpha_posterior = {action: None for action in available_actions}
-        for action in available_actions:
-            tmp = {}
-            for type_selfish, alpha_selfish in self.alpha_selfish_set.items():
-                for type_social, alpha_social in self.alpha_social_set.items():
-                    if type(self.alpha_prior) is dict:
-                        prior = self.alpha_prior[action].pmf((type_selfish, type_social))
-                    else:
-                        prior = self.alpha_prior.pmf((type_selfish, type_social))
-                    likelihood = punisher_policies[(type_selfish, type_social)][action]
-                    # for each action, alpha_posterior contains a dictionary of poterior values,
-                    # for all the possible combinations of agent types
-                    tmp[(type_selfish, type_social)] = likelihood * prior
-            # normalize the posterior
-            alpha_posterior[action] = {key: posterior/np.sum(list(tmp.values())) for key, posterior in tmp.items()}
+        alpha_selfish, alpha_social = self.get_type_arrays()
+        log_likelihood = punisher_model.batch_log_policy(available_actions, alpha_selfish, alpha_social, self.alpha_target)
+        return log_likelihood
+
+    @instrumentation.instrumented('Audience.sweep_log_likelihood_array')
+    def sweep_log_likelihood_array(self, available_actions, softmax_beta, alpha_target):
+        # log policy of the punisher model for every agent type, for arrays of softmax_beta and alpha_target values
+        # of the punisher model, with shape (n_beta, n_target, n_selfish_types, n_social_types, n_actions)
+        punisher_model = self.punisher_model(**self.punisher_model_kwargs)
+        alpha_selfish, alpha_social = self.get_type_arrays()
+        return punisher_model.sweep_log_policy(available_actions, alpha_selfish, alpha_social, softmax_beta, alpha_target)
+
+    def infer_posterior_array(self, available_actions):
+        # posterior over agent types after observing each action, with shape (n_selfish_types, n_social_types, n_actions)
+        return np.exp(self.infer_log_posterior_array(available_actions))
+
+    @instrumentation.instrumented('Audience.infer_log_posterior_array')
+    def infer_log_posterior_array(self, available_actions):
+        # log posterior over agent types after observing each action, with shape (n_selfish_types, n_social_types, n_actions)
+        log_likelihood = self.get_log_likelihood_array(available_actions)
+        return self.log_posterior_from_log_likelihood(log_likelihood, available_actions)
+
+    def posterior_from_likelihood(self, likelihood, available_actions):
+        # posterior over agent types for a given likelihood array (policy of any punisher model for
+        # every agent type), with shape (n_selfish_types, n_social_types, n_actions)
+        with np.errstate(divide='ignore'):
+            log_likelihood = np.log(likelihood)
+        return np.exp(self.log_posterior_from_log_likelihood(log_likelihood, available_actions))
+
+    def log_posterior_from_log_likelihood(self, log_likelihood, available_actions):
+        # log posterior over agent types for a given log likelihood array, normalized with log-sum-exp. The type
+        # axes are the last two but one, so the log likelihood can have leading axes, e.g. those of a sweep
+        with np.errstate(divide='ignore'):
+            log_prior = np.log(self.get_prior_array(available_actions))
+        return softmax.log_normalize(log_likelihood + log_prior, axis=(-3, -2))
+
+    @instrumentation.instrumented('Audience.infer_posterior')
+    def infer_posterior(self, available_actions):
+        alpha_posterior_array = self.infer_posterior_array(available_actions)
+        # for each action, alpha_posterior contains a dictionary of poterior values,
+        # for all the possible combinations of agent types
+        alpha_posterior = {action: {} for action in available_actions}
+        for k, action in enumerate(available_actions):
+            for i, type_selfish in enumerate(self.alpha_selfish_set.keys()):
+                for j, type_social in enumerate(self.alpha_social_set.keys()):
+                    alpha_posterior[action][(type_selfish, type_social)] = alpha_posterior_array[i, j, k]
 
         return alpha_posterior
 
+    def legitimacy_from_posterior(self, alpha_posterior):
+        # degree of legitimacy of each action, given the posterior array over agent types with shape
+        # (..., n_selfish_types, n_social_types, n_actions)
+        pass
+
     def judge_legitimacy(self, available_actions, all_alpha0=False):
         pass
 
+    @instrumentation.instrumented('Audience.sweep_judge_legitimacy')
+    def sweep_judge_legitimacy(self, available_actions, softmax_beta, alpha_target):
+        # degree of legitimacy of each action when the punisher model has each of the softmax_beta values and
+        # both the punisher model and the audience have each of the alpha_target values, with shape
+        # (n_beta, n_target, n_actions). The prior over agent types is the one of the audience, so the history of
+        # a SequentialAudience stays explained with the softmax_beta and alpha_target of its observations, which
+        # are those of the configs of their contexts, not the swept ones
+        log_likelihood = self.sweep_log_likelihood_array(available_actions, softmax_beta, alpha_target)
+        alpha_posterior = np.exp(self.log_posterior_from_log_likelihood(log_likelihood, available_actions))
+        return self.legitimacy_from_posterior(alpha_posterior)
+
 
 class Audience1(Audience):
     """
@@ -68,16 +134,16 @@ class Audience1(Audience):
                          punisher_model,
                          punisher_model_kwargs)
 
+    def legitimacy_from_posterior(self, alpha_posterior):
+        i = list(self.alpha_selfish_set.keys()).index('unselfish')
+        return np.sum(alpha_posterior[..., i, :, :], axis=-2)
+
     def judge_selfishness(self, available_actions):
-        alpha_posterior = self.infer_posterior(available_actions)
-        P_unselfish = {action: None for action in available_actions}
-        for action in available_actions:
-            tmp = 0
-            for type_social in self.alpha_social_set.keys():
-                tmp = tmp + alpha_posterior[action][('unselfish', type_social)]
-            P_unselfish[action] = tmp
+        alpha_posterior = self.infer_posterior_array(available_actions)
+        P_unselfish = dict(zip(available_actions, self.legitimacy_from_posterior(alpha_posterior)))
         return P_unselfish
 
+    @instrumentation.instrumented('Audience1.judge_legitimacy')
     def judge_legitimacy(self, available_actions, visualization=False):
         if visualization:
             P_unselfish = self.judge_selfishness(available_actions)
@@ -114,16 +180,16 @@ class Audience2(Audience):
                          punisher_model,
                          punisher_model_kwargs)
 
+    def legitimacy_from_posterior(self, alpha_posterior):
+        j = list(self.alpha_social_set.keys()).index('social')
+        return np.sum(alpha_posterior[..., :, j, :], axis=-2)
+
     def judge_socialness(self, available_actions):
-        alpha_posterior = self.infer_posterior(available_actions)
-        P_social = {action: None for action in available_actions}
-        for action in available_actions:
-            tmp = 0
-            for type_selfish in self.alpha_selfish_set.keys():
-                tmp = tmp + alpha_posterior[action][(type_selfish, 'social')]
-            P_social[action] = tmp
+        alpha_posterior = self.infer_posterior_array(available_actions)
+        P_social = dict(zip(available_actions, self.legitimacy_from_posterior(alpha_posterior)))
         return P_social
 
+    @instrumentation.instrumented('Audience2.judge_legitimacy')
     def judge_legitimacy(self, available_actions, visualization=False):
         if visualization:
             P_social = self.judge_socialness(available_actions)
@@ -153,13 +219,17 @@ class Audience3(Audience):
                          punisher_model,
                          punisher_model_kwargs)
 
+    def legitimacy_from_posterior(self, alpha_posterior):
+        i = list(self.alpha_selfish_set.keys()).index('unselfish')
+        j = list(self.alpha_social_set.keys()).index('social')
+        return alpha_posterior[..., i, j, :]
+
     def judge_selfishness_socialness(self, available_actions):
-        alpha_posterior = self.infer_posterior(available_actions)
-        P_unselfish_social = {action: None for action in available_actions}
-        for action in available_actions:
-            P_unselfish_social[action] = alpha_posterior[action][('unselfish', 'social')]
+        alpha_posterior = self.infer_posterior_array(available_actions)
+        P_unselfish_social = dict(zip(available_actions, self.legitimacy_from_posterior(alpha_posterior)))
         return P_unselfish_social
 
+    @instrumentation.instrumented('Audience3.judge_legitimacy')
     def judge_legitimacy(self, available_actions, visualization=False):
         if visualization:
             P_unselfish_social = self.judge_selfishness_socialness(available_actions)
@@ -189,23 +259,19 @@ class Audience4(Audience):
                          punisher_model,
                          punisher_model_kwargs)
 
+    def legitimacy_from_posterior(self, alpha_posterior):
+        i = list(self.alpha_selfish_set.keys()).index('unselfish')
+        j = list(self.alpha_social_set.keys()).index('social')
+        P_unselfish = np.sum(alpha_posterior[..., i, :, :], axis=-2)
+        P_social = np.sum(alpha_posterior[..., :, j, :], axis=-2)
+        return (P_unselfish + P_social) / 2
+
     def judge_selfishness_socialness(self, available_actions):
-        alpha_posterior = self.infer_posterior(available_actions)
-        P_unselfish_social = {action: None for action in available_actions}
-        for action in available_actions:
-            # unselfish
-            tmp = 0
-            for type_social in self.alpha_social_set.keys():
-                tmp = tmp + alpha_posterior[action][('unselfish', type_social)]
-            P_unselfish = tmp
-            # social
-            tmp = 0
-            for type_selfish in self.alpha_selfish_set.keys():
-                tmp = tmp + alpha_posterior[action][(type_selfish, 'social')]
-            P_social = tmp
-            P_unselfish_social[action] = (P_unselfish + P_social) / 2
+        alpha_posterior = self.infer_posterior_array(available_actions)
+        P_unselfish_social = dict(zip(available_actions, self.legitimacy_from_posterior(alpha_posterior)))
         return P_unselfish_social
 
+    @instrumentation.instrumented('Audience4.judge_legitimacy')
     def judge_legitimacy(self, available_actions, visualization=False):
         if visualization:
             P_unselfish_social = self.judge_selfishness_socialness(available_actions)
@@ -216,3 +282,80 @@ class Audience4(Audience):
             P_unselfish_social = self.judge_selfishness_socialness(available_actions)
             P_legitimate = P_unselfish_social
             return P_legitimate
+
+
+class SequentialAudience(Audience):
+    """
+    Audience that has observed a history of actions of the punisher in previous contexts, e.g. helping before
+    the punishment decision. Each observation in the history is a dictionary with the 'available_actions' and
+    the observed 'action' in that context, and the 'punisher_model' and 'punisher_model_kwargs' (and optionally
+    'alpha_target') that the audience uses to explain the action. The posterior over agent types is updated with
+    each observation in turn, and the posterior after the whole history is the prior for the current decision.
+    """
+    def __init__(self,
+                 alpha_prior,
+                 alpha_selfish_set,
+                 alpha_social_set,
+                 alpha_target,
+                 punisher_model,
+                 punisher_model_kwargs,
+                 history=None):
+        super().__init__(alpha_prior,
+                         alpha_selfish_set,
+                         alpha_social_set,
+                         alpha_target,
+                         punisher_model,
+                         punisher_model_kwargs)
+        self.history = [] if history is None else history
+
+    def get_type_log_prior(self):
+        # log prior over agent types before the history, with shape (n_selfish_types, n_social_types)
+        types = list(itertools.product(self.alpha_selfish_set.keys(), self.alpha_social_set.keys()))
+        shape = (len(self.alpha_selfish_set), len(self.alpha_social_set))
+        with np.errstate(divide='ignore'):
+            log_prior = np.log(self.alpha_prior.pmf_batch(types).reshape(shape))
+        return softmax.log_normalize(log_prior, axis=(0, 1))
+
+    def get_observation_log_likelihood_array(self, observation):
+        # log policy of the punisher model of the observation for every agent type, with shape
+        # (n_selfish_types, n_social_types, n_actions of the observation)
+        punisher_model = observation['punisher_model'](**observation['punisher_model_kwargs'])
+        alpha_selfish, alpha_social = self.get_type_arrays()
+        return punisher_model.batch_log_policy(observation['available_actions'], alpha_selfish, alpha_social,
+                                               observation.get('alpha_target', self.alpha_target))
+
+    def update_log_type_posterior(self, log_type_posterior, observation, log_likelihood=None):
+        # one step of the filter: the log posterior over agent types after observing the action of the observation
+        if log_likelihood is None:
+            log_likelihood = self.get_observation_log_likelihood_array(observation)
+        k = list(observation['available_actions']).index(observation['action'])
+        return softmax.log_normalize(log_type_posterior + log_likelihood[..., k], axis=(0, 1))
+
+    def filter_log_type_posteriors(self, history=None):
+        # log posterior over agent types after each prefix of the history, with shape
+        # (len(history) + 1, n_selfish_types, n_social_types); the first entry is the prior before the history.
+        # the likelihood of each context is computed once, however many times it occurs in the history
+        if history is None:
+            history = self.history
+        log_likelihoods = {}
+        log_type_posterior = self.get_type_log_prior()
+        log_type_posteriors = [log_type_posterior]
+        for observation in history:
+            context = fingerprint.freeze({name: value for name, value in observation.items() if name != 'action'})
+            if context not in log_likelihoods:
+                log_likelihoods[context] = self.get_observation_log_likelihood_array(observation)
+            log_type_posterior = self.update_log_type_posterior(log_type_posterior, observation, log_likelihoods[context])
+            log_type_posteriors.append(log_type_posterior)
+        return np.stack(log_type_posteriors)
+
+    def get_prior_array(self, available_actions):
+        # the posterior over agent types after the whole history, which is the same for every action
+        type_posterior = np.exp(self.filter_log_type_posteriors()[-1])
+        return np.repeat(type_posterior[..., None], len(available_actions), axis=-1)
+
+
+class SequentialAudience1(SequentialAudience, Audience1):
+    """
+    Sequential audience that considers P(unselfish) as the definition/degree of legitimacy
+    """
+    pass
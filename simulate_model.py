@@ -1,103 +1,248 @@
 
 import json
+import itertools
+import contextlib
+import concurrent.futures
 import numpy as np
 import matplotlib.pyplot as plt
 
-def _simulate_base_punisher(base_punisher, keys, params):
-    base_punisher_policy = {}
-    for key in keys:
-        base_punisher_policy[key] = {a: {} for a in params['available_actions'][key]}
-        for alpha_selfish in params['alpha_selfish_set'][key]:
-            for alpha_social in params['alpha_social_set'][key]:
-                base_punisher[key].set_alpha_selfish(alpha_selfish)
-                base_punisher[key].set_alpha_social(alpha_social)
-                policy = base_punisher[key].policy(params['available_actions'][key])
-                for action in params['available_actions'][key]:
-                    base_punisher_policy[key][action][(alpha_selfish, alpha_social)] = policy[action]
+from utils import population
+from utils import policy_store as policy_stores
+from utils import result_cache
+from utils import instrumentation
 
-    return base_punisher_policy
+# entries of the model data that are not saved in the json file
+NON_JSON_MODEL_DATA = ['policy_store', 'instrumentation']
 
+# the alpha_reputation of the pragmatic punisher with low audience value, relative to the one with high audience value
+LOW_REPUTATION_RATIO = 0.7143
 
-def _simulate_pragmatic_punisher(pragmatic_punisher, keys, params, alpha_reputation):
-    pragmatic_punisher_policy = {}
-    for key in keys:
-        pragmatic_punisher_policy[key] = {a: {} for a in params['available_actions'][key]}
-        for alpha_selfish in params['alpha_selfish_set'][key]:
-            for alpha_social in params['alpha_social_set'][key]:
-                pragmatic_punisher[key].set_alpha_selfish(alpha_selfish)
-                pragmatic_punisher[key].set_alpha_social(alpha_social)
-                pragmatic_punisher[key].set_alpha_reputation(alpha_reputation[key])
-                policy = pragmatic_punisher[key].policy(params['available_actions'][key])
-                for action in params['available_actions'][key]:
-                    pragmatic_punisher_policy[key][action][(alpha_selfish, alpha_social)] = policy[action]
-
-    return pragmatic_punisher_policy
-
-def _simulate_internal_model_of_audience(pragmatic_punisher, keys, params):
-    average_audience_judgement = {}
-    for key in keys:
-        tmp = {a: 0 for a in params['available_actions'][key]}
-        for alpha_selfish in params['alpha_selfish_set'][key]:
-            for alpha_social in params['alpha_social_set'][key]:
-                pragmatic_punisher[key].set_alpha_selfish(alpha_selfish)
-                pragmatic_punisher[key].set_alpha_social(alpha_social)
-                prevalence = params['alpha_prior'][(alpha_selfish, alpha_social)]
-                audience_judgement = pragmatic_punisher[key].simulate_audience_judgement(params['available_actions'][key])
-                for a in params['available_actions'][key]:
-                    tmp[a] += prevalence * audience_judgement[a]
-        average_audience_judgement[key] = tmp
-    return average_audience_judgement
-
-def _find_population_average(policy, keys, params):
-    average_policy = {}
+def _sweep_parameters(base_punisher, pragmatic_punisher, keys, params, alpha_reputation, softmax_beta, alpha_target,
+                      max_chunk_size=2**24):
+    # population average policies for all the combinations of alpha_reputation, softmax_beta and alpha_target values,
+    # evaluated with broadcasting over the parameter axes. The alpha_reputation axis is processed in chunks so that
+    # the policy tensor never has more than max_chunk_size elements
+    average_base_punisher_policy = {}
+    average_pragmatic_punisher_policy = {}
     for key in keys:
-        average_policy[key] = {a: 0 for a in params['available_actions'][key]}
-        for action in params['available_actions'][key]:
-            for alpha_selfish in params['alpha_selfish_set'][key]:
-                for alpha_social in params['alpha_social_set'][key]:
-                    prevalence = params['alpha_prior'][(alpha_selfish, alpha_social)]   # the prevalence of a base punisher with (alpha_selfish, alpha_social) in the population
-                    average_policy[key][action] += prevalence * policy[key][action][(alpha_selfish, alpha_social)]
-    return average_policy
-
-def simulate(config_name, config, params, save=True):
+        available_actions = params['available_actions'][key]
+        alpha_prior = population.get_prior_array(params['alpha_prior'], params['alpha_selfish_set'][key],
+                                                 params['alpha_social_set'][key])
+
+        policy = base_punisher[key].sweep_policy(available_actions, params['alpha_selfish_set'][key],
+                                                 params['alpha_social_set'][key], softmax_beta[key], alpha_target[key])
+        average_policy = population.population_average(policy, alpha_prior)
+        average_base_punisher_policy[key] = {a: average_policy[..., k].tolist() for k, a in enumerate(available_actions)}
+
+        # each alpha_reputation value adds a tensor of the size of the base punisher's policy tensor
+        chunk_size = max(1, max_chunk_size // policy.size)
+        average_policy = []
+        for i in range(0, len(alpha_reputation[key]), chunk_size):
+            policy = pragmatic_punisher[key].sweep_policy(available_actions, params['alpha_selfish_set'][key],
+                                                          params['alpha_social_set'][key], alpha_reputation[key][i:i+chunk_size],
+                                                          softmax_beta[key], alpha_target[key])
+            average_policy.append(population.population_average(policy, alpha_prior))
+        average_policy = np.concatenate(average_policy, axis=0)
+        average_pragmatic_punisher_policy[key] = {a: average_policy[..., k].tolist() for k, a in enumerate(available_actions)}
+
+    return average_base_punisher_policy, average_pragmatic_punisher_policy
+
+def _refine_grid(config, params):
+    # refine the adaptive grid in params['adaptive_grid'] on the policies of the punishers of the config, with the
+    # high and low alpha_reputation; returns params with the refined grid and prior, and the report of the refinement
+    base_punisher = {}
+    pragmatic_punisher = {}
+    with instrumentation.stage('adaptive_grid'):
+        for key in config.keys():
+            base_punisher[key] = config[key]['base_punisher']['constructor'](**config[key]['base_punisher']['kwargs'])
+            pragmatic_punisher[key] = config[key]['pragmatic_punisher']['constructor'](**config[key]['pragmatic_punisher']['kwargs'])
+        alpha_reputations_high = {key: pragmatic_punisher[key].alpha_reputation for key in config.keys()}
+        alpha_reputations_low = {key: alpha_reputations_high[key] * LOW_REPUTATION_RATIO for key in config.keys()}
+        return population.refine_grid(base_punisher, pragmatic_punisher, config.keys(), params,
+                                      [alpha_reputations_high, alpha_reputations_low])
+
+def _simulate_config(config, params, alpha_reputation=None, softmax_beta=None, alpha_target=None):
+    # if params has an 'adaptive_grid', the grid and prior of params are replaced by the refined grid first
+    adaptive_grid_report = None
+    if params.get('adaptive_grid') is not None:
+        params, adaptive_grid_report = _refine_grid(config, params)
+
     # instantiate the base punisher
     base_punisher = {}
-    for key in config.keys():
-        base_punisher[key] = config[key]['base_punisher']['constructor'](**config[key]['base_punisher']['kwargs'])
+    with instrumentation.stage('construct_base_punishers'):
+        for key in config.keys():
+            base_punisher[key] = config[key]['base_punisher']['constructor'](**config[key]['base_punisher']['kwargs'])
 
     # simulate the base punishers to obtain their policy as a function of alpha_selfish and alpha_social
-    base_punisher_policy = _simulate_base_punisher(base_punisher, config.keys(), params)
+    base_punisher_policy = population.simulate_base_punisher(base_punisher, config.keys(), params)
 
     # instantiate the pragmatic punisher
     pragmatic_punisher = {}
     alpha_reputations_high = {}
     alpha_reputations_low = {}
     for key in config.keys():
-        pragmatic_punisher[key] = config[key]['pragmatic_punisher']['constructor'](**config[key]['pragmatic_punisher']['kwargs'])
+        with instrumentation.stage('construct_pragmatic_punishers'):
+            pragmatic_punisher[key] = config[key]['pragmatic_punisher']['constructor'](**config[key]['pragmatic_punisher']['kwargs'])
         # the pragmatic punisher with high audience value uses the alpha_reputation set in the config file
         alpha_reputations_high[key] = pragmatic_punisher[key].alpha_reputation
         # the pragmatic punisher with low audience value uses an alpha_reputation equal to ~0.7 of the alpha_reputation set in the config file
         # note that the extra 0.0143 is for rounding the numbers for the paper, and it does not make any significant difference in the results.
-        alpha_reputations_low[key] = alpha_reputations_high[key] * 0.7143
+        alpha_reputations_low[key] = alpha_reputations_high[key] * LOW_REPUTATION_RATIO
         print(f"{key}: alpha_reputation_high = {alpha_reputations_high[key]}")
         print(f"{key}: alpha_reputation_low = {alpha_reputations_low[key]}")
 
     # simulate the pragmatic punishers to obtain their policy as a function of alpha_selfish and alpha_social
-    pragmatic_punisher_policy_high = _simulate_pragmatic_punisher(pragmatic_punisher, config.keys(), params, alpha_reputations_high)
-    pragmatic_punisher_policy_low = _simulate_pragmatic_punisher(pragmatic_punisher, config.keys(), params, alpha_reputations_low)
+    pragmatic_punisher_policy_high = population.simulate_pragmatic_punisher(pragmatic_punisher, config.keys(), params, alpha_reputations_high)
+    pragmatic_punisher_policy_low = population.simulate_pragmatic_punisher(pragmatic_punisher, config.keys(), params, alpha_reputations_low)
 
     # find the population average behavior
-    average_base_punisher_policy = _find_population_average(base_punisher_policy, config.keys(), params)
-    average_pragmatic_punisher_policy_high = _find_population_average(pragmatic_punisher_policy_high, config.keys(), params)
-    average_pragmatic_punisher_policy_low = _find_population_average(pragmatic_punisher_policy_low, config.keys(), params)
+    average_base_punisher_policy = population.find_population_average(base_punisher_policy, config.keys(), params)
+    average_pragmatic_punisher_policy_high = population.find_population_average(pragmatic_punisher_policy_high, config.keys(), params)
+    average_pragmatic_punisher_policy_low = population.find_population_average(pragmatic_punisher_policy_low, config.keys(), params)
 
     # simulate the audience judgement in the mind of pragmatic punishers
-    audience_judgement = _simulate_internal_model_of_audience(pragmatic_punisher, config.keys(), params)
+    audience_judgement = population.simulate_internal_model_of_audience(pragmatic_punisher, config.keys(), params)
+
+    # the per-type policies of all the keys, over the axes ('key', 'action', 'alpha_selfish', 'alpha_social', 'reputation_level')
+    key = next(iter(config.keys()))
+    with instrumentation.stage('policy_store'):
+        policy_store = policy_stores.PolicyStore.from_policies({'base': base_punisher_policy,
+                                                                'low': pragmatic_punisher_policy_low,
+                                                                'high': pragmatic_punisher_policy_high},
+                                                               params['available_actions'],
+                                                               params['alpha_selfish_set'][key],
+                                                               params['alpha_social_set'][key])
 
     model_data = {'average_base_punisher_policy': average_base_punisher_policy,
                   'average_pragmatic_punisher_policy_high': average_pragmatic_punisher_policy_high,
                   'average_pragmatic_punisher_policy_low': average_pragmatic_punisher_policy_low,
-                  'audience_judgement': audience_judgement}
+                  'audience_judgement': audience_judgement,
+                  'policy_store': policy_store}
+    if adaptive_grid_report is not None:
+        model_data['adaptive_grid'] = adaptive_grid_report
+
+    if alpha_reputation is not None or softmax_beta is not None or alpha_target is not None:
+        sweep = {}
+        sweep['alpha_reputation'] = {key: (np.atleast_1d(alpha_reputation).tolist() if alpha_reputation is not None
+                                           else [alpha_reputations_high[key], alpha_reputations_low[key]])
+                                     for key in config.keys()}
+        sweep['softmax_beta'] = {key: (np.atleast_1d(softmax_beta).tolist() if softmax_beta is not None
+                                       else [pragmatic_punisher[key].get_softmax_beta()])
+                                 for key in config.keys()}
+        sweep['alpha_target'] = {key: (np.atleast_1d(alpha_target).tolist() if alpha_target is not None
+                                       else [pragmatic_punisher[key].get_alpha_target()])
+                                 for key in config.keys()}
+        with instrumentation.stage('parameter_sweep'):
+            sweep['average_base_punisher_policy'], sweep['average_pragmatic_punisher_policy'] = \
+                _sweep_parameters(base_punisher, pragmatic_punisher, config.keys(), params,
+                                  sweep['alpha_reputation'], sweep['softmax_beta'], sweep['alpha_target'])
+        # the base punisher policies are indexed by [softmax_beta, alpha_target] and
+        # the pragmatic punisher policies by [alpha_reputation, softmax_beta, alpha_target]
+        model_data['parameter_sweep'] = sweep
+
+    return model_data
+
+def _select_key(params, key):
+    # the part of params that is needed to simulate one key of the config
+    return {name: (value if name == 'alpha_prior' else {key: value[key]}) for name, value in params.items()}
+
+def _simulate_config_key(key, config_spec, key_params, alpha_reputation=None, softmax_beta=None, alpha_target=None,
+                         instrument=False):
+    # simulate one key of the config; this is a module level function of picklable arguments (the config entry
+    # holds the constructors and their kwargs, not instantiated models) so that it can run in a worker process.
+    # if instrument is True, the instrumentation report of the worker is added to the model data
+    if not instrument:
+        return _simulate_config({key: config_spec}, key_params, alpha_reputation, softmax_beta, alpha_target)
+    with instrumentation.record() as recorder:
+        model_data = _simulate_config({key: config_spec}, key_params, alpha_reputation, softmax_beta, alpha_target)
+    model_data['instrumentation'] = recorder.report()
+    return model_data
+
+def _merge_model_data(results):
+    # merge the model data of the single keys, in the order of the keys
+    model_data = {}
+    stores = []
+    reports = []
+    for result in results:
+        for name, value in result.items():
+            if name == 'policy_store':
+                # the stores are concatenated once at the end
+                model_data.setdefault(name, None)
+                stores.append(value)
+            elif name == 'instrumentation':
+                reports.append(value)
+            elif name == 'parameter_sweep':
+                sweep = model_data.setdefault(name, {})
+                for sweep_name, sweep_value in value.items():
+                    sweep.setdefault(sweep_name, {}).update(sweep_value)
+            else:
+                model_data.setdefault(name, {}).update(value)
+    if stores:
+        model_data['policy_store'] = policy_stores.PolicyStore.concatenate(stores)
+    if reports:
+        model_data['instrumentation'] = instrumentation.merge_reports(reports)
+    return model_data
+
+def _run_simulation(config, params, alpha_reputation=None, softmax_beta=None, alpha_target=None, workers=None,
+                    instrument=False):
+    # simulate all the keys of the config, in a pool of worker processes if workers is larger than 1
+    if workers is None or workers <= 1:
+        return _simulate_config(config, params, alpha_reputation, softmax_beta, alpha_target)
+    # the keys share one grid, so an adaptive grid is refined before the keys are distributed over the workers
+    adaptive_grid_report = None
+    if params.get('adaptive_grid') is not None:
+        params, adaptive_grid_report = _refine_grid(config, params)
+    keys = list(config.keys())
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_simulate_config_key,
+                               keys,
+                               [config[key] for key in keys],
+                               [_select_key(params, key) for key in keys],
+                               itertools.repeat(alpha_reputation),
+                               itertools.repeat(softmax_beta),
+                               itertools.repeat(alpha_target),
+                               itertools.repeat(instrument))
+        model_data = _merge_model_data(results)
+    if adaptive_grid_report is not None:
+        model_data['adaptive_grid'] = adaptive_grid_report
+    return model_data
+
+def simulate(config_name, config, params, save=True, alpha_reputation=None, softmax_beta=None, alpha_target=None,
+             workers=None, save_tensors=False, cache=None, instrument=False):
+    # alpha_reputation, softmax_beta and alpha_target can be arrays of values to sweep over; if any of them is given,
+    # the population average policies for all of their combinations are added to the model data under 'parameter_sweep'.
+    # the ones that are not given are set from the config (the high and low alpha_reputation, and the softmax_beta
+    # and alpha_target of the punisher). The swept softmax_beta and alpha_target are also set for the punisher model
+    # that the audience reasons about (and alpha_target for the audience), as when they are edited in the config, so the
+    # audience judgement is simulated for each of their combinations. The history observed by a sequential audience
+    # keeps the softmax_beta and alpha_target of the configs of its contexts.
+    # if workers is larger than 1, the keys of the config are simulated in a pool of worker processes
+    # if save and save_tensors are True, the per-type policies are also saved as a memory-mappable array in the
+    # directory model_data/<config path>_tensors, which can be read with PolicyStore.load.
+    # cache can be True or a ResultCache, to reuse the results of a previous simulation with the same config, grid,
+    # prior, swept parameters and model source
+    # params can have an 'adaptive_grid' (a utils.adaptive_grid.AdaptiveGrid), which replaces the alpha grid and prior
+    # of params by a grid refined where the policies change fastest; the refined grid and its estimated error are
+    # added to the model data under 'adaptive_grid'
+    # if instrument is True, the number of calls and the time spent in the hot paths of the models and in each stage
+    # of the simulation are added to the model data under 'instrumentation'
+    worker_reports = []
+    with instrumentation.record() if instrument else contextlib.nullcontext() as recorder:
+        model_data = None
+        cache = result_cache.get_cache(cache)
+        if cache is not None:
+            cache_key = cache.key('simulate_model', config, params, alpha_reputation, softmax_beta, alpha_target)
+            with instrumentation.stage('result_cache.get'):
+                model_data = cache.get(cache_key)
+        if model_data is None:
+            model_data = _run_simulation(config, params, alpha_reputation, softmax_beta, alpha_target, workers, instrument)
+            if 'instrumentation' in model_data:
+                worker_reports.append(model_data.pop('instrumentation'))
+            if cache is not None:
+                with instrumentation.stage('result_cache.put'):
+                    cache.put(cache_key, model_data)
+    if instrument:
+        model_data['instrumentation'] = instrumentation.merge_reports([recorder.report()] + worker_reports)
 
     if save:
         # save the simulated data in the 'model_data' folder
@@ -108,6 +253,9 @@ def simulate(config_name, config, params, save=True):
         file_dir = file_dir + tmp[-1]
         print(file_dir)
         with open(f"model_data/{file_dir}.json", "w") as outfile:
-            json.dump(model_data, outfile)
+            json.dump({name: value for name, value in model_data.items() if name not in NON_JSON_MODEL_DATA}, outfile)
+        if save_tensors:
+            # save the full per-type policies in a memory-mappable format next to the json summary
+            model_data['policy_store'].save(f"model_data/{file_dir}_tensors")
 
     return model_data
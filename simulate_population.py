@@ -0,0 +1,182 @@
+
+import itertools
+import contextlib
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+from utils import random_streams
+
+# Monte Carlo simulation of a population of agents. Agents are drawn from the discretized prior over the
+# (alpha_selfish, alpha_social) grid, and each agent decides by sampling from the policy of its type, as in the
+# decide method of the punishers. The per-type policies are computed in batch by simulate (they are in the
+# 'policy_store' of the model data), so the cost of sampling grows only with the number of agents.
+# The agents are sampled in chunks of CHUNK_SIZE agents, each with its own random stream spawned from the seed, so
+# that the same seed gives the same agents and choices with any number of worker processes.
+
+CHUNK_SIZE = 2**16
+
+# the columns of data/Jordan_Rand_2020/all_data.csv
+JORDAN_COLUMNS = ['study', 'study6', 'study8', 'study9', 'study10', 'study11', 'study12', 'condition', 'punonly',
+                  'helponly', 'helpfirst', 'TG', 'q1correct', 'q2correct', 'q3correct', 'q4correct', 'q5correct',
+                  'q6correct', 'q7correct', 'compscore', 'perfectcomp', 'compscoreTG', 'perfectcompTG',
+                  'postqcorrect', 'crt', 'highcrt', 'help', 'punish', 'return', 'anger', 'bad', 'deservep',
+                  'outrage', 'compassion', 'deserves', 'good', 'posemot', 'age', 'male', 'edu', 'income', 'NFC', 'FII']
+
+# the conditions of the J. J. Jordan and Rand (2020) experiment. Each condition is a sequence of decisions of the
+# same agent, given as (column, key); the key of a decision can depend on the action of the previous decision
+JORDAN_DESIGN = {
+    'Punishment Only': {'columns': {'condition': 'Punishment Only', 'punonly': 1, 'helponly': 0},
+                        'decisions': [('punish', 'Punishment-only')]},
+    'Helping Only': {'columns': {'condition': 'Helping Only', 'punonly': 0, 'helponly': 1},
+                     'decisions': [('help', 'Help-only')]},
+    'Helping + Punishment': {'columns': {'condition': 'Punishment + Helping', 'punonly': 0, 'helponly': 0, 'helpfirst': 1},
+                             'decisions': [('help', 'Help-only'),
+                                           ('punish', {'Help': 'Both - H', 'Not-help': 'Both - NH'})]},
+    'Punishment + Helping': {'columns': {'condition': 'Punishment + Helping', 'punonly': 0, 'helponly': 0, 'helpfirst': 0},
+                             'decisions': [('punish', 'Punishment-only'),
+                                           ('help', {'Punish': 'Both - P', 'Not-punish': 'Both - NP'})]},
+}
+
+# the pragmatic punisher with low audience value models the unspecified (TG = 0) condition and the one with
+# high audience value the observed (TG = 1) condition, as in model_data/paper/Jordan_Rand_2020/preprocess.py
+JORDAN_REPUTATION_LEVELS = {0: 'low', 1: 'high'}
+
+# value of the help and punish columns for each action
+JORDAN_ACTION_VALUES = {'Not-help': 0, 'Help': 1, 'Not-punish': 0, 'Punish': 1}
+
+def sample_types(alpha_prior, n_agents, rng):
+    # indices (i_selfish, i_social) of n_agents types drawn from the discretized prior of shape (n_selfish, n_social)
+    alpha_prior = np.asarray(alpha_prior, dtype=float)
+    flat_indices = rng.choice(alpha_prior.size, size=n_agents, p=alpha_prior.ravel() / np.sum(alpha_prior))
+    return np.unravel_index(flat_indices, alpha_prior.shape)
+
+def sample_actions(policy, rng):
+    # index of one action for every row of the policy array of shape (n_agents, n_actions), by inverse transform
+    # sampling; this is the batched version of decide
+    cdf = np.cumsum(policy, axis=-1)
+    u = rng.random(policy.shape[:-1]) * cdf[..., -1]
+    return np.minimum(np.sum(cdf < u[..., None], axis=-1), policy.shape[-1] - 1)
+
+def get_key_policy(policy_store, key, reputation_level):
+    # per-type policy of one key with shape (n_selfish, n_social, n_actions), and the actions of the key
+    store = policy_store.sel(key=key, reputation_level=reputation_level)
+    actions = [a for i, a in enumerate(store.axes['action']) if not np.all(np.isnan(store.values[i]))]
+    store = store.sel(action=actions)
+    return np.moveaxis(np.asarray(store.values), 0, -1), actions
+
+def simulate_decisions(policies, type_indices, decisions, rng):
+    # the actions of agents of the given types in a sequence of decisions, as a dictionary from the column of each
+    # decision to an array with the action of every agent. policies is a dictionary from each key to its per-type
+    # policy and actions; the key of a decision is either fixed or a dictionary from the action of the agent in the
+    # previous decision to the key
+    i, j = type_indices
+    n_agents = len(i)
+    choices = {}
+    previous_actions = None
+    for column, key in decisions:
+        keys = key if isinstance(key, dict) else {None: key}
+        actions = np.empty(n_agents, dtype=object)
+        for previous_action, key in keys.items():
+            agents = np.arange(n_agents) if previous_action is None else np.flatnonzero(previous_actions == previous_action)
+            policy, key_actions = policies[key]
+            actions[agents] = np.asarray(key_actions, dtype=object)[sample_actions(policy[i[agents], j[agents]], rng)]
+        choices[column] = actions
+        previous_actions = actions
+    return choices
+
+def _simulate_chunk(policies, alpha_prior, decisions, n_agents, seed_sequence):
+    # types and choices of one chunk of agents, with the random stream of the chunk; this is a module level function
+    # so that it can run in a worker process
+    rng = random_streams.get_generator(seed_sequence)
+    type_indices = sample_types(alpha_prior, n_agents, rng)
+    return type_indices, simulate_decisions(policies, type_indices, decisions, rng)
+
+def simulate_agents(policies, alpha_prior, decisions, n_agents, seed=None, chunk_size=CHUNK_SIZE, map_function=map):
+    # types and choices of n_agents agents in a sequence of decisions, sampled in chunks of chunk_size agents with
+    # independent random streams spawned from seed. map_function can be the map of a pool of worker processes
+    sizes = random_streams.chunk_sizes(n_agents, chunk_size)
+    results = list(map_function(_simulate_chunk, itertools.repeat(policies), itertools.repeat(alpha_prior),
+                                itertools.repeat(decisions), sizes, random_streams.spawn(seed, len(sizes))))
+    if len(results) == 0:
+        return (np.zeros(0, dtype=int), np.zeros(0, dtype=int)), {column: np.zeros(0, dtype=object) for column, _ in decisions}
+    i = np.concatenate([type_indices[0] for type_indices, _ in results])
+    j = np.concatenate([type_indices[1] for type_indices, _ in results])
+    choices = {column: np.concatenate([chunk_choices[column] for _, chunk_choices in results]) for column, _ in decisions}
+    return (i, j), choices
+
+def _get_executor(workers):
+    # a pool of worker processes, or a context that does nothing if workers is None or 1
+    if workers is None or workers <= 1:
+        return contextlib.nullcontext()
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+def simulate_choices(policy_store, alpha_prior, n_agents, keys=None, reputation_levels=None, seed=None,
+                     workers=None, chunk_size=CHUNK_SIZE):
+    # choices of n_agents agents, drawn from the prior, for each key and reputation level of the policy store.
+    # returns a data frame with one row per agent, and a data frame with the rate of each action and its standard
+    # error for each key and reputation level. seed can be an integer, a SeedSequence or a Generator; the agents of
+    # each key and reputation level have their own random streams spawned from it
+    if keys is None:
+        keys = policy_store.axes['key']
+    if reputation_levels is None:
+        reputation_levels = policy_store.axes['reputation_level']
+    alpha_selfish = np.asarray(policy_store.axes['alpha_selfish'])
+    alpha_social = np.asarray(policy_store.axes['alpha_social'])
+    seeds = iter(random_streams.spawn(seed, len(keys) * len(reputation_levels)))
+
+    choices = []
+    rates = {'key': [], 'reputation_level': [], 'action': [], 'n': [], 'rate': [], 'rate_se': []}
+    with _get_executor(workers) as executor:
+        map_function = map if executor is None else executor.map
+        for key in keys:
+            for level in reputation_levels:
+                policies = {key: get_key_policy(policy_store, key, level)}
+                (i, j), agent_choices = simulate_agents(policies, alpha_prior, [('action', key)], n_agents, next(seeds),
+                                                        chunk_size, map_function)
+                choices.append(pd.DataFrame({'key': key,
+                                             'reputation_level': level,
+                                             'alpha_selfish': alpha_selfish[i],
+                                             'alpha_social': alpha_social[j],
+                                             'action': agent_choices['action']}))
+                for action in policies[key][1]:
+                    rate = np.mean(agent_choices['action'] == action)
+                    rates['key'].append(key)
+                    rates['reputation_level'].append(level)
+                    rates['action'].append(action)
+                    rates['n'].append(n_agents)
+                    rates['rate'].append(rate)
+                    rates['rate_se'].append(np.sqrt(rate * (1 - rate) / n_agents))
+    return pd.concat(choices, ignore_index=True), pd.DataFrame(rates)
+
+def simulate_Jordan_dataset(model_data, alpha_prior, n_participants, design=JORDAN_DESIGN,
+                            reputation_levels=JORDAN_REPUTATION_LEVELS, study=9, seed=None, workers=None,
+                            chunk_size=CHUNK_SIZE):
+    # synthetic participants of the J. J. Jordan and Rand (2020) experiment, in the format of
+    # data/Jordan_Rand_2020/all_data.csv, from the model data of simulate_Jordan_model.simulate. n_participants is
+    # the number of participants in each condition and TG cell (or a dictionary from (condition, TG) to the number).
+    # in the conditions with two decisions, both decisions are made by the same agent
+    policy_store = model_data['policy_store']
+    seeds = iter(random_streams.spawn(seed, len(design) * len(reputation_levels)))
+    data = []
+    with _get_executor(workers) as executor:
+        map_function = map if executor is None else executor.map
+        for condition, spec in design.items():
+            for TG, level in reputation_levels.items():
+                n = n_participants[(condition, TG)] if isinstance(n_participants, dict) else n_participants
+                keys = [key for _, decision_keys in spec['decisions']
+                        for key in (decision_keys.values() if isinstance(decision_keys, dict) else [decision_keys])]
+                policies = {key: get_key_policy(policy_store, key, level) for key in keys}
+                _, choices = simulate_agents(policies, alpha_prior, spec['decisions'], n, next(seeds), chunk_size,
+                                             map_function)
+                cell = {column: np.full(n, np.nan) for column in JORDAN_COLUMNS}
+                cell['study'] = np.full(n, study)
+                for s in [6, 8, 9, 10, 11, 12]:
+                    cell[f'study{s}'] = np.full(n, int(s == study))
+                for column, value in spec['columns'].items():
+                    cell[column] = np.full(n, value)
+                cell['TG'] = np.full(n, TG)
+                for column, actions in choices.items():
+                    cell[column] = pd.Series(actions, dtype=object).map(JORDAN_ACTION_VALUES).to_numpy()
+                data.append(pd.DataFrame(cell))
+    return pd.concat(data, ignore_index=True)
@@ -0,0 +1,94 @@
+import numpy as np
+
+from utils import instrumentation
+
+# Adaptive refinement of the (alpha_selfish, alpha_social) grid. The policies change sharply only near the types for
+# which the utilities of the actions cross, so a uniform grid spends most of its nodes where the policies are flat.
+# The grid here starts with a few cells in each dimension and splits the cells of each dimension where splitting
+# changes the prior-weighted policies most, until the estimated error of the population averages is below a
+# tolerance. The grid stays a tensor grid (one set of nodes per dimension), so the refined nodes and weights can be
+# used anywhere a regular alpha grid and discretized prior are used, e.g. in the policy store.
+
+def _split(edges):
+    # edges of the cells obtained by splitting every cell in two
+    fine_edges = np.empty(2 * len(edges) - 1)
+    fine_edges[0::2] = edges
+    fine_edges[1::2] = (edges[:-1] + edges[1:]) / 2
+    return fine_edges
+
+def _slab_errors(coarse, fine, masses, fine_masses, other_masses):
+    # change of the prior-weighted policy of every slab of cells along the first type axis of coarse (..., m, n, k)
+    # when the slab is split in two, with the policies fine (..., 2m, n, k) at the nodes of the split cells; the
+    # error of a slab is its largest change over the actions and the leading axes
+    coarse_slab = np.einsum('...ijk,i,j->...ik', coarse, masses, other_masses)
+    fine_slab = np.einsum('...ijk,i,j->...ik', fine, fine_masses, other_masses)
+    fine_slab = fine_slab.reshape(fine_slab.shape[:-2] + (len(masses), 2, fine_slab.shape[-1])).sum(axis=-2)
+    error = np.abs(coarse_slab - fine_slab)
+    return np.max(np.moveaxis(error, -2, 0).reshape(len(masses), -1), axis=1)
+
+class AdaptiveGrid():
+    """
+    Tensor grid over (alpha_selfish, alpha_social) on the rectangle bounds, refined on the policies of a model.
+    alpha_prior is a JointIndependent prior, truncated to bounds; the weight of each node is the prior mass of its cell
+    """
+    def __init__(self, alpha_prior, bounds=((0, 10), (0, 10)), initial_cells=8, tolerance=1e-3, max_cells=256,
+                 max_iterations=20):
+        self.alpha_prior = alpha_prior
+        self.bounds = bounds
+        self.initial_cells = initial_cells      # number of cells of each dimension before refining
+        self.tolerance = tolerance              # tolerance on the population average of every action
+        self.max_cells = max_cells              # largest number of cells of each dimension
+        self.max_iterations = max_iterations
+
+    def get_masses(self, edges, i):
+        # prior mass of the cells of dimension i, normalized to the mass within the bounds
+        lower, upper = self.bounds[i]
+        marginal = self.alpha_prior.marginals[i]
+        return np.diff(marginal.cdf(edges)) / (marginal.cdf(upper) - marginal.cdf(lower))
+
+    def refine(self, policy_function):
+        # refine the grid on policy_function(alpha_selfish, alpha_social), which returns a list of policy arrays of
+        # shape (..., n_selfish, n_social, n_actions), e.g. the policies of all the keys of a config. Returns the
+        # nodes of each dimension, their weights with shape (n_selfish, n_social) and a report of the refinement
+        edges = [np.linspace(lower, upper, self.initial_cells + 1) for lower, upper in self.bounds]
+        evaluations = 0
+        for iteration in range(1, self.max_iterations + 1):
+            nodes = [(e[:-1] + e[1:]) / 2 for e in edges]
+            masses = [self.get_masses(e, i) for i, e in enumerate(edges)]
+            coarse = policy_function(*nodes)
+            evaluations += len(nodes[0]) * len(nodes[1])
+
+            # the error of each cell of each dimension, from the policies at the nodes of the split cells
+            errors = []
+            for i in range(2):
+                fine_edges = _split(edges[i])
+                fine_nodes = list(nodes)
+                fine_nodes[i] = (fine_edges[:-1] + fine_edges[1:]) / 2
+                fine = policy_function(*fine_nodes)
+                evaluations += len(fine_nodes[0]) * len(fine_nodes[1])
+                fine_masses = self.get_masses(fine_edges, i)
+                errors.append(np.max([_slab_errors(np.swapaxes(c, -3, -2) if i else c,
+                                                   np.swapaxes(f, -3, -2) if i else f,
+                                                   masses[i], fine_masses, masses[1 - i])
+                                      for c, f in zip(coarse, fine)], axis=0))
+
+            error = sum(np.sum(e) for e in errors)
+            n_cells = sum(len(e) for e in errors)
+            if error <= self.tolerance or all(len(n) >= self.max_cells for n in nodes):
+                break
+
+            # split the cells with more than their share of the tolerance, or at least the worst cell
+            threshold = min(self.tolerance / n_cells, max(np.max(e) for e in errors))
+            for i in range(2):
+                split = np.flatnonzero(errors[i] >= threshold)
+                split = split[np.argsort(errors[i][split])[::-1][:max(0, self.max_cells - len(nodes[i]))]]
+                edges[i] = np.sort(np.concatenate([edges[i], (edges[i][split] + edges[i][split + 1]) / 2]))
+
+        instrumentation.count('AdaptiveGrid.evaluations', evaluations)
+        weights = np.multiply.outer(masses[0], masses[1])
+        report = {'alpha_selfish': nodes[0].tolist(),
+                  'alpha_social': nodes[1].tolist(),
+                  'error': float(error),
+                  'iterations': iteration,
+                  'evaluations': evaluations}
+        return nodes, weights, report
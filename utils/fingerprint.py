@@ -0,0 +1,22 @@
+import numpy as np
+
+def freeze(obj):
+    # convert a (nested) model specification, e.g. the kwargs of a punisher or an audience,
+    # into a hashable structure that only depends on its content
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (str, int, float, bool, bytes, type(None))):
+        return obj
+    if isinstance(obj, dict):
+        return ('dict', tuple((freeze(key), freeze(value)) for key, value in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(freeze(value) for value in obj))
+    if isinstance(obj, np.ndarray):
+        return ('ndarray', obj.dtype.str, obj.shape, obj.tobytes())
+    if isinstance(obj, type) or (callable(obj) and hasattr(obj, '__qualname__')):
+        # classes and functions, e.g. the constructors in the config files
+        return ('callable', obj.__module__, obj.__qualname__)
+    if hasattr(obj, 'dist') and hasattr(obj, 'args') and hasattr(obj, 'kwds'):
+        # frozen scipy.stats distributions
+        return ('rv_frozen', obj.dist.name, freeze(obj.args), freeze(obj.kwds))
+    return ('object', type(obj).__module__, type(obj).__qualname__, freeze(vars(obj)))
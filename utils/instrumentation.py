@@ -0,0 +1,98 @@
+import time
+import functools
+import contextlib
+
+# Opt-in call counters and timers for the hot paths of the models and the simulators. Functions are marked with
+# the instrumented decorator, code blocks with the stage context manager, and events such as cache hits with count.
+# Nothing is recorded unless a recorder is active, e.g.
+#
+#     with instrumentation.record() as recorder:
+#         ...
+#     report = recorder.report()
+#
+# When no recorder is active, an instrumented function only adds one global lookup to each call.
+
+_recorder = None
+
+class Recorder():
+    """
+    Accumulates the number of calls and the total (inclusive) time of every instrumented function or stage,
+    and the value of every counter
+    """
+    def __init__(self):
+        self.calls = {}
+        self.times = {}
+        self.counters = {}
+
+    def add_call(self, name, elapsed):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.times[name] = self.times.get(name, 0.0) + elapsed
+
+    def add_count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        # the recorded values as a json-serializable dictionary
+        return {'stages': {name: {'calls': self.calls[name], 'time': self.times[name]} for name in self.calls},
+                'counters': dict(self.counters)}
+
+def merge_reports(reports):
+    # sum of the reports of several recorders, e.g. of the worker processes of a simulation
+    merged = {'stages': {}, 'counters': {}}
+    for report in reports:
+        for name, stage in report['stages'].items():
+            merged_stage = merged['stages'].setdefault(name, {'calls': 0, 'time': 0.0})
+            merged_stage['calls'] += stage['calls']
+            merged_stage['time'] += stage['time']
+        for name, value in report['counters'].items():
+            merged['counters'][name] = merged['counters'].get(name, 0) + value
+    return merged
+
+def is_enabled():
+    return _recorder is not None
+
+@contextlib.contextmanager
+def record(recorder=None):
+    # activates a recorder for the duration of the context; nested contexts record into their own recorder
+    global _recorder
+    previous = _recorder
+    _recorder = Recorder() if recorder is None else recorder
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+
+def instrumented(name):
+    # decorator that records the calls and the time of a function under the given name
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            recorder = _recorder
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.add_call(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def _timed_stage(recorder, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add_call(name, time.perf_counter() - start)
+
+def stage(name):
+    # context manager that records the time of a block of code under the given name
+    if _recorder is None:
+        return contextlib.nullcontext()
+    return _timed_stage(_recorder, name)
+
+def count(name, n=1):
+    # adds n to the counter with the given name
+    if _recorder is not None:
+        _recorder.add_count(name, n)
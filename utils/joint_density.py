@@ -1,6 +1,8 @@
 
 import numpy as np
 
+from utils import quadrature
+
 class ContinuousDistribution():
     def __init__(self):
         pass
@@ -13,6 +15,10 @@ class ContinuousDistribution():
         # return the marginal pdf of ith variable at point x_i
         pass
 
+    def pdf_batch(self, points):
+        # return the joint pdf at each point in a sequence of points
+        return np.array([self.pdf(x) for x in points])
+
 
 class DiscreteDistribution():
     def __init__(self):
@@ -22,6 +28,10 @@ class DiscreteDistribution():
         # return the joint pmf at point x
         pass
 
+    def pmf_batch(self, points):
+        # return the joint pmf at each point in a sequence of points
+        return np.array([self.pmf(x) for x in points])
+
     def marginal_pmf(self, x_i, i):
         # return the marginal pmf of ith variable at point x_i
         pass
@@ -33,6 +43,7 @@ class JointIndependent(ContinuousDistribution):
         self.marginals = marginals      # the list of scipy distribution objects for each dimension of the multidimensional RV
 
     def pdf(self, x):
+        # x can be a single point, or a tuple with one array per dimension (e.g. the output of np.meshgrid)
         pdf = 1
         for x_i, marginal_i in zip(x, self.marginals):
             pdf = pdf * marginal_i.pdf(x_i)
@@ -42,6 +53,35 @@ class JointIndependent(ContinuousDistribution):
     def marginal_pdf(self, x_i, i):
         return self.marginals[i].pdf(x_i)
 
+    def outer_pdf(self, grids):
+        # joint pdf on the grid spanned by the 1d arrays in grids, computed as the outer product of the
+        # vectorized marginal pdfs; the output has shape (len(grids[0]), len(grids[1]), ...)
+        pdf = np.ones(())
+        for grid_i, marginal_i in zip(grids, self.marginals):
+            pdf = np.multiply.outer(pdf, marginal_i.pdf(np.asarray(grid_i)))
+
+        return pdf
+
+    def discretize(self, grids):
+        # discretized prior on the grid spanned by the 1d arrays in grids, normalized to sum to 1
+        pdf = self.outer_pdf(grids)
+        return pdf / np.sum(pdf)
+
+    def quadrature(self, n_nodes, bounds=None):
+        # nodes of a Gaussian quadrature rule for each marginal, and the weights of all their combinations, which
+        # sum to 1 and have shape (n_nodes[0], n_nodes[1], ...); n_nodes can be one number for all the dimensions,
+        # and bounds a list with the (lower, upper) bounds of each dimension (or None) to truncate the marginals
+        n_nodes = np.broadcast_to(n_nodes, len(self.marginals))
+        bounds = [None] * len(self.marginals) if bounds is None else bounds
+        grids = []
+        weights = np.ones(())
+        for marginal_i, n_i, bounds_i in zip(self.marginals, n_nodes, bounds):
+            nodes_i, weights_i = quadrature.gauss_nodes(marginal_i, int(n_i), bounds_i)
+            grids.append(nodes_i)
+            weights = np.multiply.outer(weights, weights_i)
+
+        return grids, weights
+
 
 class DistFromEstimate(ContinuousDistribution):
     def __init__(self,
@@ -50,15 +90,23 @@ class DistFromEstimate(ContinuousDistribution):
         super().__init__()
         self.pdf_values = pdf_values
         self.domain = domain
+        self.pdf_array = np.asarray(pdf_values)
+        # map from the values in the domain of each dimension to their index in pdf_array
+        self.domain_index = [{x_i: j for j, x_i in enumerate(domain_i)} for domain_i in domain]
 
-    def pdf(self, x):
-        x_indices = []
-        for i, x_i in enumerate(x):
-            x_indices.append(np.where(np.array(self.domain[i])==x_i)[0][0])
+    def get_indices(self, points):
+        # indices of a sequence of points in pdf_array, as a tuple with one index array per dimension
+        return tuple(np.array([self.domain_index[i][x[i]] for x in points], dtype=int)
+                     for i in range(len(self.domain_index)))
 
-        pdf = np.array(self.pdf_values)[tuple(x_indices)]
+    def pdf(self, x):
+        x_indices = tuple(self.domain_index[i][x_i] for i, x_i in enumerate(x))
+        pdf = self.pdf_array[x_indices]
         return pdf
 
+    def pdf_batch(self, points):
+        return self.pdf_array[self.get_indices(points)]
+
 
 class JointDiscrete(DiscreteDistribution):
     def __init__(self,
@@ -66,8 +114,25 @@ class JointDiscrete(DiscreteDistribution):
                  domain):
         super().__init__()
         self.pmf_values = pmf_values   # dictionary of pmf values for each combination of possible values of random variable
+        if domain is None:
+            # the domain of each dimension in the order of appearance in pmf_values
+            domain = [list(dict.fromkeys(x[i] for x in pmf_values.keys())) for i in range(len(next(iter(pmf_values))))]
         self.domain = domain
+        # map from the values in the domain of each dimension to their index in pmf_array
+        self.domain_index = [{x_i: j for j, x_i in enumerate(domain_i)} for domain_i in domain]
+        # pmf values as an array with one axis per dimension; combinations missing from pmf_values have probability 0
+        self.pmf_array = np.zeros(tuple(len(domain_i) for domain_i in domain))
+        self.pmf_array[self.get_indices(list(pmf_values.keys()))] = list(pmf_values.values())
+
+    def get_indices(self, points):
+        # indices of a sequence of points in pmf_array, as a tuple with one index array per dimension
+        return tuple(np.array([self.domain_index[i][x[i]] for x in points], dtype=int)
+                     for i in range(len(self.domain_index)))
 
     def pmf(self, x):
-        pmf = self.pmf_values[x]
+        x_indices = tuple(self.domain_index[i][x_i] for i, x_i in enumerate(x))
+        pmf = self.pmf_array[x_indices]
         return pmf
+
+    def pmf_batch(self, points):
+        return self.pmf_array[self.get_indices(points)]
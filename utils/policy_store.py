@@ -0,0 +1,213 @@
+import os
+import json
+import collections.abc
+import numpy as np
+
+class PolicyStore():
+    """
+    Policies (or any other per-action results) over named axes, e.g. ('key', 'action', 'alpha_selfish',
+    'alpha_social', 'reputation_level'), stored in one contiguous array. The labels of each axis are kept in
+    self.axes, so results can be sliced by label, and keys with fewer actions than the others are padded with nan
+    """
+    def __init__(self, values, axes):
+        self.values = np.asanyarray(values)
+        self.axes = dict(axes)      # dictionary from axis names to the list of labels, in the order of the axes
+        assert self.values.shape == tuple(len(labels) for labels in self.axes.values())
+
+    @classmethod
+    def from_policies(cls, policies, available_actions, alpha_selfish_set, alpha_social_set):
+        # policies is a dictionary {reputation_level: {key: array of shape (n_selfish, n_social, n_actions)}},
+        # as returned by the population.simulate_* functions; all the keys must share the same alpha grid
+        levels = list(policies.keys())
+        keys = list(policies[levels[0]].keys())
+        actions = list(dict.fromkeys(a for key in keys for a in available_actions[key]))
+        values = np.full((len(keys), len(actions), len(alpha_selfish_set), len(alpha_social_set), len(levels)), np.nan)
+        for i, key in enumerate(keys):
+            action_indices = [actions.index(a) for a in available_actions[key]]
+            for l, level in enumerate(levels):
+                values[i, action_indices, :, :, l] = np.moveaxis(policies[level][key], -1, 0)
+        axes = {'key': keys,
+                'action': actions,
+                'alpha_selfish': list(np.asarray(alpha_selfish_set).tolist()),
+                'alpha_social': list(np.asarray(alpha_social_set).tolist()),
+                'reputation_level': levels}
+        return cls(values, axes)
+
+    @classmethod
+    def concatenate(cls, stores, axis='key'):
+        # concatenate stores along one axis; the labels of the 'action' axis are merged and padded with nan
+        actions = list(dict.fromkeys(a for store in stores for a in store.axes.get('action', [])))
+        values = []
+        for store in stores:
+            if 'action' in store.axes and axis != 'action':
+                store = store.reindex('action', actions)
+            values.append(store.values)
+        axes = dict(stores[0].axes)
+        if 'action' in axes:
+            axes['action'] = actions
+        axes[axis] = [label for store in stores for label in store.axes[axis]]
+        return cls(np.concatenate(values, axis=list(axes).index(axis)), axes)
+
+    def reindex(self, axis, labels):
+        # store with the given labels along axis, padded with nan for labels that are not in the store
+        n = list(self.axes).index(axis)
+        shape = list(self.values.shape)
+        shape[n] = len(labels)
+        values = np.full(shape, np.nan)
+        for j, label in enumerate(labels):
+            if label in self.axes[axis]:
+                values[(slice(None),) * n + (j,)] = self.values[(slice(None),) * n + (self.axes[axis].index(label),)]
+        axes = dict(self.axes)
+        axes[axis] = list(labels)
+        return PolicyStore(values, axes)
+
+    def index(self, axis, label):
+        # index of a label along an axis; numeric labels (e.g. the alpha values from np.arange) are matched with a
+        # tolerance, so that labels computed in a different way still find their index
+        labels = self.axes[axis]
+        if label in labels:
+            return labels.index(label)
+        if isinstance(label, (int, float, np.number)):
+            matches = np.flatnonzero(np.isclose(np.asarray(labels, dtype=float), label))
+            if len(matches) > 0:
+                return int(matches[0])
+        raise KeyError(f"{label} is not a label of the {axis} axis")
+
+    def sel(self, **labels):
+        # select by label; a single label drops the axis, a list of labels keeps it
+        index = []
+        axes = {}
+        for axis, axis_labels in self.axes.items():
+            if axis not in labels:
+                index.append(slice(None))
+                axes[axis] = axis_labels
+            elif isinstance(labels[axis], (list, tuple, np.ndarray)):
+                index.append([self.index(axis, label) for label in labels[axis]])
+                axes[axis] = [axis_labels[i] for i in index[-1]]
+            else:
+                index.append(self.index(axis, labels[axis]))
+        # index the axes one by one, so that lists of labels on several axes select their outer product
+        values = self.values
+        n = 0
+        for i in index:
+            values = values[(slice(None),) * n + (i,)]
+            if not isinstance(i, int):
+                n += 1
+        return PolicyStore(values, axes)
+
+    def population_average(self, alpha_prior):
+        # prevalence-weighted average over the alpha_selfish and alpha_social axes
+        names = list(self.axes)
+        values = np.moveaxis(self.values, [names.index('alpha_selfish'), names.index('alpha_social')], [-2, -1])
+        axes = {axis: labels for axis, labels in self.axes.items() if axis not in ('alpha_selfish', 'alpha_social')}
+        return PolicyStore(np.sum(values * alpha_prior, axis=(-2, -1)), axes)
+
+    def save(self, path):
+        # save the store as a raw .npy array plus a json manifest with the axis labels in the directory path;
+        # unlike .npz files, the array can be memory-mapped when it is loaded
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'values.npy'), np.ascontiguousarray(self.values))
+        manifest = {'axes': [[axis, [_to_json_label(label) for label in labels]] for axis, labels in self.axes.items()],
+                    'shape': list(self.values.shape),
+                    'dtype': self.values.dtype.str}
+        with open(os.path.join(path, 'manifest.json'), 'w') as outfile:
+            json.dump(manifest, outfile)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        # load a store saved with save(); by default the array is memory-mapped read-only, so that slices can be
+        # read without loading the whole array
+        with open(os.path.join(path, 'manifest.json')) as infile:
+            manifest = json.load(infile)
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+        return cls(values, {axis: labels for axis, labels in manifest['axes']})
+
+    def view(self):
+        # read-only nested mapping over the axes in their order, e.g. view[key][action] for a store with the axes
+        # ('key', 'action'), which is compatible with the dictionaries returned by simulate
+        return PolicyView(self)
+
+    def to_dict(self):
+        # nested dictionaries over the axes in their order, e.g. for json.dump. Unlike view(), every axis is one
+        # level (alpha_selfish then alpha_social, instead of (alpha_selfish, alpha_social) pairs), and the labels
+        # and values are python scalars; the nan padding of keys with fewer actions is left out
+        return _to_dict(self.values, list(self.axes.items()))
+
+    @classmethod
+    def from_dict(cls, data, axes):
+        # store from the nested dictionaries of to_dict over the axes with the given names, also after a json
+        # round trip, which turns the labels into strings: labels that are numbers in a string are converted back
+        labels = {axis: [] for axis in axes}
+        def collect(data, n):
+            for label in data:
+                if label not in labels[axes[n]]:
+                    labels[axes[n]].append(label)
+                if n + 1 < len(axes):
+                    collect(data[label], n + 1)
+        collect(data, 0)
+        values = np.full(tuple(len(axis_labels) for axis_labels in labels.values()), np.nan)
+        def fill(data, index):
+            for label, value in data.items():
+                i = index + (labels[axes[len(index)]].index(label),)
+                if isinstance(value, dict):
+                    fill(value, i)
+                else:
+                    values[i] = value
+        fill(data, ())
+        return cls(values, {axis: [_from_json_label(label) for label in axis_labels] for axis, axis_labels in labels.items()})
+
+
+class PolicyView(collections.abc.Mapping):
+    def __init__(self, store):
+        self.store = store
+        axes = list(store.axes)
+        self.axis = axes[0]
+        # the alpha_selfish and alpha_social axes are viewed together with (alpha_selfish, alpha_social) labels,
+        # as in the per-type policy dictionaries of the simulators
+        self.type_axes = axes[:2] == ['alpha_selfish', 'alpha_social']
+
+    def _labels(self):
+        labels = self.store.axes[self.axis]
+        if self.type_axes:
+            return [(alpha_selfish, alpha_social) for alpha_selfish in labels
+                    for alpha_social in self.store.axes['alpha_social']]
+        if self.axis == 'action':
+            # skip the nan padding of keys with fewer actions
+            return [a for i, a in enumerate(labels) if not np.all(np.isnan(self.store.values[i]))]
+        return labels
+
+    def __getitem__(self, label):
+        if self.type_axes:
+            store = self.store.sel(alpha_selfish=label[0], alpha_social=label[1])
+        else:
+            store = self.store.sel(**{self.axis: label})
+        if len(store.axes) == 0:
+            return store.values[()]
+        return PolicyView(store)
+
+    def __iter__(self):
+        return iter(self._labels())
+
+    def __len__(self):
+        return len(self._labels())
+
+
+def _to_dict(values, axes):
+    if len(axes) == 0:
+        return values.item()
+    (axis, labels), axes = axes[0], axes[1:]
+    return {_to_json_label(label): _to_dict(values[i], axes) for i, label in enumerate(labels)
+            if not (axis == 'action' and np.all(np.isnan(values[i])))}
+
+def _to_json_label(label):
+    return label.item() if isinstance(label, np.generic) else label
+
+def _from_json_label(label):
+    # the number in a label that json has turned into a string, e.g. '0.1' or '250'
+    if isinstance(label, str):
+        for number_type in (int, float):
+            try:
+                return number_type(label)
+            except ValueError:
+                pass
+    return label
@@ -0,0 +1,87 @@
+import numpy as np
+
+from utils import instrumentation
+
+# Helpers shared by the simulators. The policies of the punishers are stored per config key as arrays of
+# shape (n_selfish, n_social, n_actions) over the (alpha_selfish, alpha_social) grid, and population averages
+# are weighted reductions of these arrays with the discretized prior over the grid.
+
+def get_prior_array(alpha_prior, alpha_selfish_set, alpha_social_set):
+    # the discretized prior as an array of shape (n_selfish, n_social); alpha_prior can already be
+    # such an array, or a dictionary keyed by (alpha_selfish, alpha_social)
+    if isinstance(alpha_prior, dict):
+        return np.array([[alpha_prior[(alpha_selfish, alpha_social)] for alpha_social in alpha_social_set]
+                         for alpha_selfish in alpha_selfish_set])
+    return np.asarray(alpha_prior)
+
+def population_average(policy, alpha_prior):
+    # prevalence-weighted average of a policy tensor of shape (..., n_selfish, n_social, n_actions)
+    # over the types in the population, with shape (..., n_actions)
+    return np.einsum('...ijk,ij->...k', policy, alpha_prior)
+
+@instrumentation.instrumented('population.refine_grid')
+def refine_grid(base_punisher, pragmatic_punisher, keys, params, alpha_reputations):
+    # refine the AdaptiveGrid in params['adaptive_grid'] on the policies of the base punishers and of the pragmatic
+    # punishers with each of alpha_reputations (a list of dictionaries over the keys), for all the keys at once so
+    # that they share one grid. Returns params with the refined grid and prior, and the report of the refinement
+    def policy_function(alpha_selfish, alpha_social):
+        policies = []
+        for key in keys:
+            available_actions = params['available_actions'][key]
+            policies.append(base_punisher[key].batch_policy(available_actions, alpha_selfish, alpha_social))
+            for alpha_reputation in alpha_reputations:
+                pragmatic_punisher[key].set_alpha_reputation(alpha_reputation[key])
+                policies.append(pragmatic_punisher[key].batch_policy(available_actions, alpha_selfish, alpha_social))
+        return policies
+
+    (alpha_selfish_set, alpha_social_set), alpha_prior, report = params['adaptive_grid'].refine(policy_function)
+    refined_params = {name: value for name, value in params.items() if name != 'adaptive_grid'}
+    refined_params['alpha_selfish_set'] = {key: alpha_selfish_set for key in keys}
+    refined_params['alpha_social_set'] = {key: alpha_social_set for key in keys}
+    refined_params['alpha_prior'] = alpha_prior
+    return refined_params, report
+
+@instrumentation.instrumented('population.simulate_base_punisher')
+def simulate_base_punisher(base_punisher, keys, params):
+    # policy of all the (alpha_selfish, alpha_social) base punishers on the grid, for each key
+    base_punisher_policy = {}
+    for key in keys:
+        base_punisher_policy[key] = base_punisher[key].batch_policy(params['available_actions'][key],
+                                                                    params['alpha_selfish_set'][key],
+                                                                    params['alpha_social_set'][key])
+    return base_punisher_policy
+
+@instrumentation.instrumented('population.simulate_pragmatic_punisher')
+def simulate_pragmatic_punisher(pragmatic_punisher, keys, params, alpha_reputation):
+    # policy of all the (alpha_selfish, alpha_social) pragmatic punishers on the grid, for each key
+    pragmatic_punisher_policy = {}
+    for key in keys:
+        pragmatic_punisher[key].set_alpha_reputation(alpha_reputation[key])
+        pragmatic_punisher_policy[key] = pragmatic_punisher[key].batch_policy(params['available_actions'][key],
+                                                                              params['alpha_selfish_set'][key],
+                                                                              params['alpha_social_set'][key])
+    return pragmatic_punisher_policy
+
+@instrumentation.instrumented('population.simulate_internal_model_of_audience')
+def simulate_internal_model_of_audience(pragmatic_punisher, keys, params):
+    # population average of the audience judgement in the mind of the pragmatic punishers. The judgement does not
+    # depend on the type of the punisher, so it is simulated once and broadcast over the grid
+    average_audience_judgement = {}
+    for key in keys:
+        available_actions = params['available_actions'][key]
+        alpha_prior = get_prior_array(params['alpha_prior'], params['alpha_selfish_set'][key], params['alpha_social_set'][key])
+        audience_judgement = pragmatic_punisher[key].simulate_audience_judgement(available_actions)
+        audience_judgement = np.array([audience_judgement[a] for a in available_actions], dtype=float)
+        average = population_average(np.broadcast_to(audience_judgement, alpha_prior.shape + audience_judgement.shape),
+                                     alpha_prior)
+        average_audience_judgement[key] = dict(zip(available_actions, average))
+    return average_audience_judgement
+
+@instrumentation.instrumented('population.find_population_average')
+def find_population_average(policy, keys, params):
+    # population average of the policy of each key, as a dictionary over the available actions
+    average_policy = {}
+    for key in keys:
+        alpha_prior = get_prior_array(params['alpha_prior'], params['alpha_selfish_set'][key], params['alpha_social_set'][key])
+        average_policy[key] = dict(zip(params['available_actions'][key], population_average(policy[key], alpha_prior)))
+    return average_policy
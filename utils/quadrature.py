@@ -0,0 +1,55 @@
+import numpy as np
+from scipy import special
+
+# Integration of the population average over the prior of alpha_selfish and alpha_social. A population average is
+# a weighted sum of the policies at a set of nodes, so an integration backend is just a way of choosing the nodes of
+# each dimension and their weights: GridIntegration uses a fixed grid with the normalized prior density as weights
+# (a Riemann sum, which truncates the prior at the end of the grid), and GaussIntegration uses Gaussian quadrature
+# for the marginals of the prior, with many fewer nodes for the same accuracy.
+
+def gauss_nodes(marginal, n_nodes, bounds=None):
+    # nodes and weights (summing to 1) of a Gaussian quadrature rule for the expectation over a frozen scipy
+    # distribution. The exponential distribution uses Gauss-Laguerre nodes over its whole support and the uniform
+    # distribution Gauss-Legendre nodes; any other distribution, or any distribution truncated to bounds, uses
+    # Gauss-Legendre nodes on the bounds (by default the 1e-10 and 1-1e-10 quantiles) weighted by its density
+    name = marginal.dist.name
+    if bounds is None and name == 'expon':
+        # the exponential distribution starts at loc and its standard deviation is its scale
+        t, w = special.roots_laguerre(n_nodes)
+        return marginal.support()[0] + marginal.std() * t, w / np.sum(w)
+    if bounds is None and name == 'uniform':
+        lower, upper = marginal.support()
+        t, w = special.roots_legendre(n_nodes)
+        return lower + (upper - lower) * (t + 1) / 2, w / np.sum(w)
+    if bounds is None:
+        bounds = (marginal.ppf(1e-10), marginal.ppf(1 - 1e-10))
+    lower, upper = bounds
+    t, w = special.roots_legendre(n_nodes)
+    x = lower + (upper - lower) * (t + 1) / 2
+    w = w * marginal.pdf(x)
+    return x, w / np.sum(w)
+
+class GridIntegration():
+    """
+    Riemann sum of the prior on a fixed grid, the same grid for every dimension
+    """
+    def __init__(self, alpha_range=None):
+        self.alpha_range = np.arange(0, 10, 0.1) if alpha_range is None else np.asarray(alpha_range)
+
+    def nodes(self, alpha_prior):
+        # the nodes of each dimension and the weights of all their combinations, with shape (n_selfish, n_social)
+        grids = [self.alpha_range] * len(alpha_prior.marginals)
+        return grids, alpha_prior.discretize(grids)
+
+class GaussIntegration():
+    """
+    Gaussian quadrature of the marginals of the prior, with n_nodes nodes in each dimension (or a list with the
+    number of nodes of each dimension); bounds is None or a list with None or the (lower, upper) bounds of each
+    dimension, to truncate the prior
+    """
+    def __init__(self, n_nodes=16, bounds=None):
+        self.n_nodes = n_nodes
+        self.bounds = bounds
+
+    def nodes(self, alpha_prior):
+        return alpha_prior.quadrature(self.n_nodes, self.bounds)
@@ -0,0 +1,32 @@
+import numpy as np
+
+# Random number streams for the stochastic parts of the model. Functions that sample take a numpy Generator, a
+# SeedSequence or an integer seed; simulations that are split in chunks give every chunk its own child stream,
+# spawned from one SeedSequence, so that the same seed gives the same samples however the chunks are distributed
+# over worker processes.
+
+def get_generator(rng=None):
+    # a random generator from a Generator, a SeedSequence or an integer seed; None gives the np.random module, whose
+    # sampling functions (np.random.multinomial, np.random.choice, ...) draw from the global random state, so that
+    # code seeded with np.random.seed behaves as before
+    if rng is None:
+        return np.random
+    if isinstance(rng, (np.random.Generator, np.random.RandomState)):
+        return rng
+    return np.random.default_rng(rng)
+
+def get_seed_sequence(seed=None):
+    # a SeedSequence from a SeedSequence, a Generator or an integer seed; None gives a SeedSequence with fresh entropy
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return seed.bit_generator.seed_seq
+    return np.random.SeedSequence(seed)
+
+def spawn(seed, n):
+    # n independent child SeedSequences of seed
+    return get_seed_sequence(seed).spawn(n)
+
+def chunk_sizes(n, chunk_size):
+    # sizes of the chunks of n items; they depend only on n and chunk_size, and not on the number of workers
+    return [min(chunk_size, n - start) for start in range(0, n, chunk_size)]
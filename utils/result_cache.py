@@ -0,0 +1,101 @@
+import os
+import glob
+import pickle
+import hashlib
+
+from utils import fingerprint
+
+# the source files of the model; a change in any of them changes the cache keys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_SOURCE_FILES = ['models/*.py', 'utils/*.py', 'simulate_model.py', 'simulate_Jordan_model.py']
+
+def source_version(patterns=MODEL_SOURCE_FILES):
+    # hash of the content of the model source files
+    digest = hashlib.sha256()
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(ROOT_DIR, pattern))):
+            digest.update(os.path.relpath(path, ROOT_DIR).encode())
+            with open(path, 'rb') as infile:
+                digest.update(infile.read())
+    return digest.hexdigest()
+
+
+class ResultCache():
+    """
+    Content-addressed on-disk cache of simulation results. Entries are keyed by a stable hash of everything the
+    result depends on (config structure, alpha grid, prior, and the version of the model source), and the least
+    recently used entries are evicted when the total size of the cache exceeds max_bytes
+    """
+    def __init__(self, cache_dir='.simulate_cache', max_bytes=2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts):
+        # stable hash of the given parts (any nesting of configs, arrays, distributions, ...) and the model source
+        frozen = fingerprint.freeze(list(parts) + [source_version()])
+        return hashlib.sha256(repr(frozen).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        # the stored result, or None if the key is not in the cache
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        with open(path, 'rb') as infile:
+            result = pickle.load(infile)
+        # the modification time of an entry is its last use, for the least recently used eviction
+        os.utime(path)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._path(key) + '.tmp'
+        with open(tmp_path, 'wb') as outfile:
+            pickle.dump(result, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        # remove the least recently used entries until the cache fits in max_bytes
+        entries = self.entries()
+        total_bytes = sum(entry['size'] for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry['last_used']):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(self._path(entry['key']))
+            total_bytes -= entry['size']
+
+    def entries(self):
+        # list of the entries in the cache, with their size in bytes and the time they were last used
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+            stat = os.stat(path)
+            entries.append({'key': os.path.basename(path)[:-len('.pkl')],
+                            'size': stat.st_size,
+                            'last_used': stat.st_mtime})
+        return entries
+
+    def purge(self, key=None):
+        # remove one entry, or all the entries if key is None
+        keys = [entry['key'] for entry in self.entries()] if key is None else [key]
+        for key in keys:
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+
+    def info(self):
+        entries = self.entries()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                'bytes': sum(entry['size'] for entry in entries), 'max_bytes': self.max_bytes}
+
+
+def get_cache(cache):
+    # cache can be None (no caching), True (the default cache) or a ResultCache
+    if cache is True:
+        return ResultCache()
+    return cache
@@ -0,0 +1,26 @@
+import numpy as np
+from scipy import special
+
+def log_softmax(V):
+    # log of the softmax over the last axis (the actions) of an array of scaled utilities
+    # V = softmax_beta * U_total, computed with log-sum-exp so that it does not overflow or underflow
+    # for large utilities. For two actions it is the log-logistic function of the utility difference
+    V = np.asarray(V, dtype=float)
+    if V.shape[-1] == 2:
+        V_diff = V[..., 1] - V[..., 0]
+        return np.stack([-np.logaddexp(0, V_diff), -np.logaddexp(0, -V_diff)], axis=-1)
+    return V - special.logsumexp(V, axis=-1, keepdims=True)
+
+def softmax(V):
+    # softmax over the last axis (the actions) of an array of scaled utilities V = softmax_beta * U_total.
+    # for two actions the softmax is the logistic function of the utility difference, which skips the
+    # exponentiation and normalization of the general n-action case
+    V = np.asarray(V, dtype=float)
+    if V.shape[-1] == 2:
+        V_diff = V[..., 1] - V[..., 0]
+        return np.stack([special.expit(-V_diff), special.expit(V_diff)], axis=-1)
+    return np.exp(log_softmax(V))
+
+def log_normalize(log_p, axis):
+    # normalize an array of unnormalized log probabilities over the given axis (or tuple of axes)
+    return log_p - special.logsumexp(log_p, axis=axis, keepdims=True)